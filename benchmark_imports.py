@@ -0,0 +1,84 @@
+"""Measure the startup import time of each entry script.
+
+Each script's top-level import statements are run under `python -X importtime`
+(the scripts can't be imported directly since they run on import).
+The fastest of several repeats is kept, and results are printed
+and exported to derivatives/benchmark_imports.tsv.
+
+    $ python benchmark_imports.py
+    $ python benchmark_imports.py --repeat 10
+"""
+import argparse
+import ast
+import csv
+from pathlib import Path
+import subprocess
+import sys
+
+import utils
+
+
+ENTRY_SCRIPTS = [
+    "runall.py",
+    "source2raw.py",
+    "demographics.py",
+    "corr_table.py",
+    "wakeup_impact.py",
+    "wakeup_timing.py",
+    "wakeup_lucidity.py",
+    "control_emotion.py",
+    "email_lists.py",
+]
+
+
+def get_import_code(script):
+    """Return the top-level import statements of `script` as code."""
+    with open(script, "r", encoding="utf-8") as fp:
+        tree = ast.parse(fp.read())
+    imports = [node for node in tree.body if isinstance(node, (ast.Import, ast.ImportFrom))]
+    return "\n".join(ast.unparse(node) for node in imports)
+
+def time_imports(code, ignore=()):
+    """Return the total and per-module cumulative import times (microseconds) of `code`.
+
+    Modules in `ignore` (e.g., those imported at interpreter startup) are left out.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True, check=True
+    )
+    module_times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        # Nested imports are indented, only keep those imported directly.
+        if not name[1:].startswith(" ") and name.strip() not in ignore:
+            module_times[name.strip()] = int(cumulative)
+    return sum(module_times.values()), module_times
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Measure the startup import time of each entry script.")
+    parser.add_argument("--repeat", type=int, default=5, help="Number of runs per script, fastest is kept.")
+    args = parser.parse_args()
+
+    config = utils.load_config()
+    export_path = Path(config["root_directory"]) / "derivatives" / "benchmark_imports.tsv"
+
+    _, startup_modules = time_imports("pass")
+    rows = []
+    for script in ENTRY_SCRIPTS:
+        code = get_import_code(script)
+        timings = [time_imports(code, ignore=startup_modules) for _ in range(args.repeat)]
+        total, module_times = min(timings, key=lambda x: x[0])
+        slowest = max(module_times, key=module_times.get)
+        rows.append(dict(script=script, total_ms=total / 1000, slowest_import=slowest,
+            slowest_import_ms=module_times[slowest] / 1000))
+        print(f"{script:<24} {total / 1000:8.1f} ms  (slowest: {slowest} {module_times[slowest] / 1000:.1f} ms)")
+
+    export_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(export_path, "w", encoding="utf-8", newline="") as fp:
+        writer = csv.DictWriter(fp, fieldnames=list(rows[0]), delimiter="\t")
+        writer.writeheader()
+        writer.writerows(rows)
@@ -0,0 +1,120 @@
+"""Time each step of the pipeline on synthetic data of increasing size.
+
+For each number of participants, synthetic sources are generated (see synthetic_data.py)
+into their own study folder under derivatives/benchmark, with a copy of the configuration
+pointing there. Then loading, cleaning, scoring, source2raw.py, loading the raw data,
+and each analysis script are timed. The fastest of several repeats is kept, and results
+are printed and exported to derivatives/benchmark_pipeline.tsv.
+
+    $ python benchmark_pipeline.py
+    $ python benchmark_pipeline.py --participants 1000 100000 1000000 --scripts demographics.py
+"""
+import argparse
+import csv
+import json
+import os
+from pathlib import Path
+import subprocess
+import sys
+import time
+
+import runall
+import synthetic_data
+import utils
+
+
+def time_call(func, repeat=1):
+    """Return the fastest wall time (seconds) of calling `func` `repeat` times, and its last result."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+def run_script(script, timeout=None):
+    """Run a script (from this folder, in the current directory) and raise if it fails."""
+    subprocess.run([sys.executable, str(Path(__file__).parent / script)], check=True, timeout=timeout,
+        stdout=subprocess.DEVNULL)
+
+def benchmark_study(scripts, repeat=1, timeout=None):
+    """Return [(step, seconds)] for the study of the configuration file in the current directory."""
+    timings = []
+    def record(step, func):
+        seconds, result = time_call(func, repeat)
+        timings.append((step, seconds))
+        print(f"  {step:<42} {seconds:8.2f} s", flush=True)
+        return result
+
+    for which in utils.SOURCE_PATTERNS:
+        record(f"load_qualtrics_source({which}, uncached)", lambda: utils.load_qualtrics_source(which, use_cache=False))
+        utils.load_qualtrics_source(which)  # fill the cache
+        df, _ = record(f"load_qualtrics_source({which})", lambda: utils.load_qualtrics_source(which))
+        record(f"standard_qualtrics_clean({which})", lambda: utils.standard_qualtrics_clean(df))
+
+    record("source2raw.py", lambda: run_script("source2raw.py", timeout))
+    raw_df, _ = record("load_raw", lambda: utils.load_raw())
+    record("load_raw(trim=True)", lambda: utils.load_raw(trim=True))
+
+    # Rescore the raw data like source2raw.py does.
+    scales = {
+        "LUSK": {"items": [f"LUSK_{i}" for i in range(1, 5)], "method": "mean"},
+        "Dream_LUSK": {"items": [f"Dream_LUSK_{i}" for i in range(1, 5)], "method": "mean"},
+        "PANAS": {"items": [f"PANAS_{i}" for i in range(1, 21)], "method": "sum"},
+    }
+    record("score_scales", lambda: utils.score_scales(raw_df, scales))
+
+    for script in scripts:
+        try:
+            record(script, lambda: run_script(script, timeout))
+        except subprocess.TimeoutExpired:
+            print(f"  {script:<42} timed out", flush=True)
+            timings.append((script, float("nan")))
+    return timings
+
+
+if __name__ == "__main__":
+
+    config = utils.load_config()
+    analysis_scripts = [script for script in runall.build_steps(config) if script != "source2raw.py"]
+
+    parser = argparse.ArgumentParser(description="Time each step of the pipeline on synthetic data.")
+    parser.add_argument("--participants", type=int, nargs="+", default=[1000, 10000, 100000],
+        help="Numbers of participants to generate, each benchmarked separately.")
+    parser.add_argument("--scripts", nargs="*", default=analysis_scripts, help="Analysis scripts to time.")
+    parser.add_argument("--repeat", type=int, default=1, help="Number of runs per step, fastest is kept.")
+    parser.add_argument("--timeout", type=float, default=None, help="Seconds before a script is given up on.")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed of the synthetic data.")
+    args = parser.parse_args()
+
+    root_dir = Path(config["root_directory"]).resolve()
+    benchmark_dir = root_dir / "derivatives" / "benchmark"
+    export_path = root_dir / "derivatives" / "benchmark_pipeline.tsv"
+
+    rows = []
+    for n_participants in args.participants:
+        # Each study gets its own folder, and a configuration file pointing to it.
+        study_dir = benchmark_dir / f"synthetic-{n_participants}"
+        code_dir = study_dir / "code"
+        code_dir.mkdir(parents=True, exist_ok=True)
+        (study_dir / "derivatives").mkdir(exist_ok=True)
+        with open(code_dir / "config.json", "w", encoding="utf-8") as fp:
+            json.dump({**config, "root_directory": "../"}, fp, indent=4)
+        if not any((study_dir / "sourcedata").glob("*.sav")):
+            print(f"Generating {n_participants} participants", flush=True)
+            synthetic_data.write_sources(study_dir, n_participants, config["collection_rounds"], seed=args.seed)
+
+        print(f"Benchmarking {n_participants} participants", flush=True)
+        cwd = os.getcwd()
+        os.chdir(code_dir)
+        try:
+            timings = benchmark_study(args.scripts, repeat=args.repeat, timeout=args.timeout)
+        finally:
+            os.chdir(cwd)
+        rows.extend(dict(participants=n_participants, step=step, seconds=seconds) for step, seconds in timings)
+
+    export_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(export_path, "w", encoding="utf-8", newline="") as fp:
+        writer = csv.DictWriter(fp, fieldnames=list(rows[0]), delimiter="\t")
+        writer.writeheader()
+        writer.writerows(rows)
@@ -3,10 +3,12 @@ Run correlation analysis asking if dream control influenced emotion.
 """
 from pathlib import Path
 
-import matplotlib.pyplot as plt
+from matplotlib.ticker import MultipleLocator
 import numpy as np
 import pingouin as pg
 
+import profiling
+import resampling
 import utils
 
 
@@ -27,9 +29,6 @@ control_limits[1] += 0.5
 emotion_limits[0] -= 5
 emotion_limits[1] += 5
 
-# Load custom plotting settings.
-utils.load_matplotlib_settings()
-
 # Choose filepaths.
 config = utils.load_config()
 root_dir = Path(config["root_directory"])
@@ -58,7 +57,15 @@ desc = df[[control_col, emotion_col]].describe().T.rename_axis("variable")
 # Run correlation.
 x = df[control_col].to_numpy()
 y = df[emotion_col].to_numpy()
-stat = pg.corr(x, y, method="kendall")
+with profiling.stage("pg.corr", rows_in=len(x)):
+    stat = pg.corr(x, y, method="kendall")
+
+# Add permutation p-value and bootstrapped confidence interval.
+resampling_kwargs = dict(n_resamples=config["n_resamples"], seed=config["random_seed"], n_jobs=config["n_jobs"])
+_, pval_perm = resampling.permutation_test(x, y, resampling.kendall_statistic, **resampling_kwargs)
+tau_ci = resampling.bootstrap_ci(x, y, resampling.kendall_statistic, **resampling_kwargs)
+stat["p-val_perm"] = pval_perm
+stat["CI95%_boot"] = [tau_ci.round(2)]
 
 
 ################################################################################
@@ -69,23 +76,25 @@ stat = pg.corr(x, y, method="kendall")
 coef = np.polyfit(x, y, 1)
 poly1d_func = np.poly1d(coef)
 
-# Open figure.
-fig, ax = plt.subplots(figsize=(1.8, 1.8))
+# Open figure, and draw with the figure style.
+with utils.figure_style():
+    fig = utils.new_figure(figsize=(1.8, 1.8))
+    ax = fig.subplots()
 
-# Draw dots and regression line.
-ax.plot(x, y, "ko", ms=8, alpha=0.4)
-ax.plot(x, poly1d_func(x), "-k")
+    # Draw dots and regression line.
+    ax.plot(x, y, "ko", ms=8, alpha=0.4)
+    ax.plot(x, poly1d_func(x), "-k")
 
-# Aesthetics.
-ax.set_xlabel(control_label)
-ax.set_ylabel(emotion_label)
-# ax.set_xlim(*control_limits)
-# ax.set_ylim(*emotion_limits)
-ax.xaxis.set_major_locator(plt.MultipleLocator(1))
-ax.yaxis.set_major_locator(plt.MultipleLocator(10))
-ax.grid(False, axis="both")
-ax.tick_params(direction="out", axis="both", which="both", top=False, right=False)
-ax.margins(0.12)
+    # Aesthetics.
+    ax.set_xlabel(control_label)
+    ax.set_ylabel(emotion_label)
+    # ax.set_xlim(*control_limits)
+    # ax.set_ylim(*emotion_limits)
+    ax.xaxis.set_major_locator(MultipleLocator(1))
+    ax.yaxis.set_major_locator(MultipleLocator(10))
+    ax.grid(False, axis="both")
+    ax.tick_params(direction="out", axis="both", which="both", top=False, right=False)
+    ax.margins(0.12)
 
 
 ################################################################################
@@ -93,7 +102,5 @@ ax.margins(0.12)
 ################################################################################
 
 desc.to_csv(export_path_desc, na_rep="n/a", sep="\t")
-stat.to_csv(export_path_desc, index_label="method", na_rep="n/a", sep="\t")
-plt.savefig(export_path_plot)
-plt.savefig(export_path_plot.with_suffix(".pdf"))
-plt.savefig(export_path_plot.with_suffix(".svg"))
+stat.to_csv(export_path_stat, index_label="method", na_rep="n/a", sep="\t")
+utils.save_figure(fig, export_path_plot)
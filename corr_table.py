@@ -1,23 +1,24 @@
 """Big exploratory correlation table."""
 from pathlib import Path
 
-import matplotlib.pyplot as plt
+from matplotlib.ticker import FixedLocator, MultipleLocator, NullFormatter
 import numpy as np
-import pingouin as pg
+import pandas as pd
 
 import utils
 
 
-plt.rcParams["savefig.dpi"] = 600
-plt.rcParams["figure.constrained_layout.use"] = True
-plt.rcParams["font.family"] = "Times New Roman"
-plt.rcParams["font.size"] = 8
-plt.rcParams["axes.titlesize"] = 8
-plt.rcParams["axes.labelsize"] = 8
-plt.rcParams["axes.labelsize"] = 8
-plt.rcParams["xtick.labelsize"] = 8
-plt.rcParams["ytick.labelsize"] = 8
-plt.rcParams["axes.linewidth"] = 0.8
+# Plot settings (see utils.figure_style), on top of matplotlib's defaults.
+STYLE = {
+    "savefig.dpi": 600,
+    "font.family": "Times New Roman",
+    "font.size": 8,
+    "axes.titlesize": 8,
+    "axes.labelsize": 8,
+    "xtick.labelsize": 8,
+    "ytick.labelsize": 8,
+    "axes.linewidth": 0.8,
+}
 
 config = utils.load_config()
 
@@ -43,87 +44,100 @@ columns = [
 # Choose filepaths.
 root_dir = Path(config["root_directory"])
 export_path_plot = root_dir / "derivatives" / "corr_table.png"
+export_path_stat = root_dir / "derivatives" / "corr_table.tsv"
 
 # Load data.
 df, meta = utils.load_raw(trim=True)
 
-# Draw.
-n_vars = len(columns)
-figsize = (0.9*n_vars, 0.9*n_vars)
-fig, axes = plt.subplots(nrows=n_vars, ncols=n_vars, figsize=figsize, sharex="col", sharey=False)
+# Get all pairwise correlations at once.
+r_mat, p_mat = utils.kendall_matrix(df, columns)
 
+# Bin edges of each variable, one bin per response level.
 def get_bins(var):
     if "LUSK" in var:
         levels = [1, 2, 3, 4, 5]
     elif "PANAS" in var:
         levels = range(10, 51)
     else:
-        levels = [int(k) for k in meta[var]["Levels"]]
+        levels = list(meta.levels(var))
     low_lim = min(levels) - 0.5
     high_lim = max(levels) + 0.5
     return np.linspace(low_lim, high_lim, len(levels) + 1)
 
-hist1d_kwargs = dict(color="white", edgecolor="black", linewidth=1, clip_on=False)
-hist2d_kwargs = dict(cmap="Blues", clip_on=False)
-
-for c in range(n_vars):
-    xvar = columns[c]
-    xbins = get_bins(xvar)
-    xvals = df[xvar].values
-    for r in range(n_vars):
-        yvar = columns[r]
-        ybins = get_bins(yvar)
-        yvals = df[yvar].values
-
-        ax = axes[r, c]
-        ax.set_aspect("auto")
-
-        if c > r:
-            ax.axis("off")
-            continue
-        
-        if c == r:
-            ax.hist(xvals, bins=xbins, **hist1d_kwargs)
-        else:
-            stats = pg.corr(xvals, yvals, method="kendall")
-            r, p = stats.loc["kendall", ["r", "p-val"]]
-
-            ax.hist2d(xvals, yvals, bins=(xbins, ybins), **hist2d_kwargs)
-            ax.set_ylim(ybins.min(), ybins.max())
-            if yvar.endswith("_recall"):
-                ax.invert_yaxis()
-            if ax.get_subplotspec().is_first_col():
-                ax.set_ylabel(yvar.replace("_", "\n"))
-
-        ax.set_xlim(xbins.min(), xbins.max())
-        if xvar.endswith("_recall"):
-            ax.invert_xaxis()
-        if ax.get_subplotspec().is_last_row():
-            ax.set_xlabel(xvar.replace("_", "\n"))
-            x_minorlocator = plt.matplotlib.ticker.MultipleLocator(1)
-            x_majorlocator = plt.matplotlib.ticker.FixedLocator(
+bins = {var: get_bins(var) for var in columns}
+
+# Count all histograms at once, so drawing doesn't have to.
+counts_1d, counts_2d = utils.pairwise_histograms(df, bins)
+
+# Draw.
+# Only the lower triangle gets axes, on a fixed grid (constrained layout gets slow with many axes).
+n_vars = len(columns)
+figsize = (0.9*n_vars, 0.9*n_vars)
+with utils.figure_style(STYLE):
+    fig = utils.new_figure(figsize=figsize)
+    margin = 0.7 / figsize[0]
+    gridspec = fig.add_gridspec(nrows=n_vars, ncols=n_vars,
+        left=margin, bottom=margin, right=0.98, top=0.99, wspace=0.15, hspace=0.15)
+
+    hist1d_kwargs = dict(color="white", edgecolor="black", linewidth=1, clip_on=False)
+    hist2d_kwargs = dict(cmap="Blues", interpolation="nearest", aspect="auto", origin="lower")
+
+    for c in range(n_vars):
+        xvar = columns[c]
+        xbins = bins[xvar]
+        for r in range(c, n_vars):
+            yvar = columns[r]
+            ybins = bins[yvar]
+
+            ax = fig.add_subplot(gridspec[r, c])
+
+            if c == r:
+                ax.bar(xbins[:-1], counts_1d[xvar], width=np.diff(xbins), align="edge", **hist1d_kwargs)
+            else:
+                rval, pval = r_mat.loc[yvar, xvar], p_mat.loc[yvar, xvar]
+
+                extent = (xbins.min(), xbins.max(), ybins.min(), ybins.max())
+                ax.imshow(counts_2d[xvar, yvar].T, extent=extent, **hist2d_kwargs)
+                ax.set_ylim(ybins.min(), ybins.max())
+                if yvar.endswith("_recall"):
+                    ax.invert_yaxis()
+                if c == 0:
+                    ax.set_ylabel(yvar.replace("_", "\n"))
+
+            ax.set_xlim(xbins.min(), xbins.max())
+            if xvar.endswith("_recall"):
+                ax.invert_xaxis()
+            # Same ticks down each column, only labeled on the bottom row.
+            x_minorlocator = MultipleLocator(1)
+            x_majorlocator = FixedLocator(
                 [xbins[:2].mean(), xbins[-2:].mean()])
             ax.xaxis.set_minor_locator(x_minorlocator)
             ax.xaxis.set_major_locator(x_majorlocator)
-
-        if r == c:
-            ax.spines[["left", "top", "right"]].set_visible(False)
-        if ax.get_subplotspec().is_first_row() or not ax.get_subplotspec().is_first_col():
-            ax.yaxis.set_major_formatter(plt.matplotlib.ticker.NullFormatter())
-            ax.tick_params(left=False)
-        else:
-            y_minorlocator = plt.matplotlib.ticker.MultipleLocator(1)
-            y_majorlocator = plt.matplotlib.ticker.FixedLocator(
-                [ybins[:2].mean(), ybins[-2:].mean()])
-            ax.yaxis.set_minor_locator(y_minorlocator)
-            ax.yaxis.set_major_locator(y_majorlocator)
-
-        if r != c:
-            text = f"r = {r:.2f}\np = {p:.3f}".replace("0.", ".")
-            color = "black" if p < .1 else "gainsboro"
-            ax.text(0.95, 0.05, text, color=color, va="bottom", ha="right", transform=ax.transAxes)
-
-fig.align_labels()
+            if r == n_vars - 1:
+                ax.set_xlabel(xvar.replace("_", "\n"))
+            else:
+                ax.xaxis.set_major_formatter(NullFormatter())
+
+            if r == c:
+                ax.spines[["left", "top", "right"]].set_visible(False)
+            if r == 0 or c != 0:
+                ax.yaxis.set_major_formatter(NullFormatter())
+                ax.tick_params(left=False)
+            else:
+                y_minorlocator = MultipleLocator(1)
+                y_majorlocator = FixedLocator(
+                    [ybins[:2].mean(), ybins[-2:].mean()])
+                ax.yaxis.set_minor_locator(y_minorlocator)
+                ax.yaxis.set_major_locator(y_majorlocator)
+
+            if r != c:
+                text = f"r = {rval:.2f}\np = {pval:.3f}".replace("0.", ".")
+                color = "black" if pval < .1 else "gainsboro"
+                ax.text(0.95, 0.05, text, color=color, va="bottom", ha="right", transform=ax.transAxes)
+
+    fig.align_labels()
 
 # Export.
-plt.savefig(export_path_plot)
+stat = pd.concat({"r": r_mat, "p-val": p_mat}, names=["statistic", "variable"])
+stat.to_csv(export_path_stat, index=True, na_rep="n/a", sep="\t")
+utils.save_figure(fig, export_path_plot, formats=["png"], dpi=STYLE["savefig.dpi"], style=STYLE)
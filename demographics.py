@@ -1,7 +1,7 @@
 """Get some general summary statistics of the whole sample."""
 from pathlib import Path
 
-import pandas as pd
+import numpy as np
 
 import utils
 
@@ -30,7 +30,8 @@ columns = [
     "age", "gender", "Dream_recall", "Nightmare_recall", "Lucid_recall",
 ]
 
-desc = data[columns].describe().T
+# Categorical columns hold integer response codes, describe them as numbers.
+desc = data[columns].astype(float).describe().T
 desc.to_csv(export_path, index_label="variable", na_rep="n/a", sep="\t")
 
 
@@ -42,14 +43,11 @@ desc.to_csv(export_path, index_label="variable", na_rep="n/a", sep="\t")
 df, meta = utils.load_raw(trim=False)
 
 # Add a new column that identifies varying levels of study completion.
-def participation_level(row):
-    level = "pt1_finished"
-    if row["Completed_part2"]:
-        level = "pt2_finished"
-    if row["Task_completion"] == 3:
-        level = "pt2_finished_task"
-    return level
-df["completion"] = df.apply(participation_level, axis=1)
+df["completion"] = np.select(
+    [df["Task_completion"].eq(3), df["Completed_part2"].eq(True)],
+    ["pt2_finished_task", "pt2_finished"],
+    default="pt1_finished",
+)
 
 # Pick variables to include in frequency table.
 variables = [
@@ -57,23 +55,10 @@ variables = [
     "Dream_recall", "Nightmare_recall", "Lucid_recall",
 ]
 
-# Get full text labels.
-for c in variables:
-    if c != "Condition":
-        response_legend = {int(k): v for k, v in meta[c]["Levels"].items()}
-        df[c] = df[c].map(response_legend)
-
-freqs = (df
-    .set_index("completion")[variables]
-    .stack()
-    .groupby(level=[0,1])
-    .value_counts()
-    .unstack(0)
-    .fillna(0)
-    .rename_axis(None, axis=1)
+# Count responses for each completion level, with full text labels.
+labels = {c: meta.levels(c) for c in variables if c != "Condition"}
+freqs = (utils.frequency_table(df, variables, by="completion", labels=labels)
     .rename_axis(["response", "probe"])
-    .pipe(lambda d: d.assign(total=d.sum(axis=1)))
-    .astype(int)
 )
 
 freqs.to_csv(export_path_freq, index=True, na_rep="n/a", sep="\t")
@@ -0,0 +1,155 @@
+"""Export the email lists, all from one load of the initial questionnaire.
+
+- listserve_reminders.csv has those who requested a weekly reminder up till
+  either the end of the study or they finish the second part, with the info
+  needed for each participant when loaded into Qualtrics as a contact list.
+- listserve_participation.txt has those who checked a box to get notified
+  of future studies.
+- listserve_publication.txt has those who checked a box to get information
+  about publication of this work.
+
+Emails are normalized (trimmed and lowercased), those that aren't addresses
+are removed, and each address is only listed once per list.
+
+With --delta, only the changes since the last export are written, as an
+"-added" file in the same format as the full list and a "-removed" file with
+just the emails (e.g., reminder recipients who finished the second part).
+The emails of each export are kept in email_lists/email_lists.json to compare against.
+
+When sending the reminders, use a Qualtrics contact list.
+    - From name: Paller Cognitive Neuroscience Lab
+    - Reply-To email: remington.mallett@northwestern.edu
+    - Subject: Northwestern LD Study Reminder
+    - Message: in Qualtrics library (have to copy/paste)
+
+Grab freshest data and rerun right before sending.
+
+    $ python email_lists.py           # full lists
+    $ python email_lists.py --delta   # only what changed since the last export
+"""
+import argparse
+from datetime import datetime, timezone
+import json
+from pathlib import Path
+
+import pandas as pd
+
+import utils
+
+
+# Initial questionnaire checkboxes of each list, and the end of their probes to make sure they're right.
+LIST_KEYS = {
+    "participation": ("Email_other_1", "Similar lucid dreaming study opportunities in the future"),
+    "publication": ("Email_other_2", "Any published work that comes from this current study"),
+    "reminders": ("Email_other_4", None),
+}
+
+# Columns of the reminders contact list.
+REMINDER_COLUMNS = ["Email", "ParticipantID", "TaskInstructions"]
+
+EMAIL_PATTERN = r"^[^@\s]+@[^@\s]+\.[^@\s]+$"
+
+
+def normalize_emails(ser):
+    """Return trimmed, lowercased emails, with missing values for anything that isn't an address."""
+    ser = ser.astype("string").str.strip().str.lower()
+    return ser.where(ser.str.fullmatch(EMAIL_PATTERN).fillna(False).astype(bool))
+
+def build_lists(initial_df, completed_pids):
+    """Return {list name: emails} from the initial questionnaire, a dataframe for reminders and a series otherwise.
+
+    Reminders leave out participants in `completed_pids` (those who finished the second part).
+    Where an address is in a list more than once, its most recent response is kept.
+    """
+    df = initial_df.assign(Email=normalize_emails(initial_df["Email"])).dropna(subset=["Email"])
+
+    lists = {}
+    for name in ["participation", "publication"]:
+        key, _ = LIST_KEYS[name]
+        lists[name] = df.loc[df[key].eq(1), "Email"].drop_duplicates().sort_values()
+
+    key, _ = LIST_KEYS["reminders"]
+    reminders = df.dropna(subset=["ParticipantID", key])
+    assert reminders[key].eq(1).all()
+    reminders = reminders[reminders["ParticipantID"].str.len() == 6]
+    reminders = reminders.astype({"ParticipantID": int})
+    reminders = reminders[~reminders["ParticipantID"].isin(completed_pids)]
+    reminders = reminders.drop_duplicates(subset="Email", keep="last")
+    lists["reminders"] = reminders[REMINDER_COLUMNS].sort_values("ParticipantID")
+    return lists
+
+def list_emails(emails):
+    """Return the sorted addresses of a list from `build_lists`."""
+    if isinstance(emails, pd.DataFrame):
+        emails = emails["Email"]
+    return sorted(emails)
+
+def export_list(emails, export_path):
+    """Write a list from `build_lists`, reminders as a csv and the others one address per line."""
+    if isinstance(emails, pd.DataFrame):
+        emails.to_csv(export_path, index=False)
+    else:
+        emails.to_csv(export_path, index=False, header=False)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Export the email lists.")
+    parser.add_argument("--delta", action="store_true", help="Only export the changes since the last export.")
+    args = parser.parse_args()
+
+    config = utils.load_config()
+    root_dir = Path(config["root_directory"])
+    export_dir = root_dir / "email_lists"
+    export_paths = {
+        "reminders": export_dir / "listserve_reminders.csv",
+        "participation": export_dir / "listserve_participation.txt",
+        "publication": export_dir / "listserve_publication.txt",
+    }
+    state_path = export_dir / "email_lists.json"
+
+    # Load each source once, streaming only the needed columns.
+    initial_usecols = ["Email", "ParticipantID", "TaskInstructions", "Email_other_1", "Email_other_2", "Email_other_4"]
+    initial_df, initial_meta = utils.stream_qualtrics_source("initial", usecols=initial_usecols, clean=False)
+    morning_df, _ = utils.stream_qualtrics_source("morning", usecols=["ParticipantID"], clean=False)
+
+    # Make sure the keys/columns are correct.
+    for key, probe in LIST_KEYS.values():
+        if probe is not None:
+            assert initial_meta.column_names_to_labels[key].endswith(probe)
+
+    # Those who submitted the final report don't need reminders.
+    completed_pids = morning_df["ParticipantID"].astype(int).tolist()
+
+    lists = build_lists(initial_df, completed_pids)
+
+    # Emails of the last export.
+    previous = {}
+    if state_path.exists():
+        with open(state_path, "r", encoding="utf-8") as fp:
+            previous = json.load(fp)["lists"]
+
+    export_dir.mkdir(parents=True, exist_ok=True)
+    for name, emails in lists.items():
+        export_path = export_paths[name]
+        if not args.delta:
+            export_list(emails, export_path)
+            continue
+        previous_emails = set(previous.get(name, []))
+        new_emails = set(list_emails(emails))
+        if isinstance(emails, pd.DataFrame):
+            added = emails[~emails["Email"].isin(previous_emails)]
+        else:
+            added = emails[~emails.isin(previous_emails)]
+        removed = pd.Series(sorted(previous_emails - new_emails), dtype="string")
+        export_list(added, export_path.with_name(f"{export_path.stem}-added{export_path.suffix}"))
+        export_list(removed, export_path.with_name(f"{export_path.stem}-removed.txt"))
+        print(f"{name}: {len(added)} added, {len(removed)} removed")
+
+    # Only record the export once all lists are written.
+    state = {
+        "exported": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "lists": {name: list_emails(emails) for name, emails in lists.items()},
+    }
+    with open(state_path, "w", encoding="utf-8") as fp:
+        json.dump(state, fp, indent=4)
@@ -0,0 +1,145 @@
+"""Column metadata (probes and response levels) of the survey data.
+
+Qualtrics exports carry a probe (question text) and response levels for each column.
+`load_column_metadata` merges those of all source files into one mapping,
+cached by the source file contents. The raw data sidecar (data.json) holds the
+same info for the columns that were kept, and `load_raw` returns it as a `Sidecar`.
+"""
+import hashlib
+import json
+from pathlib import Path
+
+import profiling
+
+
+class Sidecar(dict):
+    """Raw data sidecar, a dict of the json contents with typed lookups.
+
+        sidecar.probe("Wakeup")   # question text, or None
+        sidecar.levels("Wakeup")  # {1: "...", 2: "...", ...} with integer codes
+        sidecar.remapping("Wakeup")  # {source code: code in the data} if recoded from the source
+    """
+    DESCRIPTION_KEY = "MeasurementToolMetadata"
+
+    @property
+    def columns(self):
+        """Columns with metadata."""
+        return [k for k in self if k != self.DESCRIPTION_KEY]
+
+    @property
+    def likert_columns(self):
+        """Columns with response levels."""
+        return [k for k in self.columns if "Levels" in self[k]]
+
+    def probe(self, column):
+        """Return the question text of `column`, or None if it has none."""
+        return self.get(column, {}).get("Probe")
+
+    def levels(self, column):
+        """Return the response levels of `column` as {integer code: label}, empty if it has none."""
+        return {int(k): v for k, v in self.get(column, {}).get("Levels", {}).items()}
+
+    def remapping(self, column):
+        """Return the {source code: new code} recoding applied to `column`, empty if it wasn't recoded."""
+        return {int(k): v for k, v in self.get(column, {}).get("Remapping", {}).items()}
+
+
+def merge_column_metadata(metas):
+    """Return {column: {"Probe": ..., "Levels": {code: label}}} from pyreadstat metadata of multiple files.
+
+    Earlier files in `metas` take precedence for columns in more than one file.
+    Columns without a probe or levels are left out, as are the missing parts of those that have one.
+    """
+    probes = {}
+    levels = {}
+    for meta in reversed(metas):
+        probes.update(meta.column_names_to_labels)
+        levels.update(meta.variable_value_labels)
+    column_metadata = {}
+    for col in dict.fromkeys([*probes, *levels]):
+        column_info = {}
+        if probes.get(col) is not None:
+            column_info["Probe"] = probes[col]
+        if col in levels:
+            column_info["Levels"] = {int(k): v for k, v in levels[col].items()}
+        if column_info:
+            column_metadata[col] = column_info
+    return column_metadata
+
+@profiling.profiled
+def load_column_metadata(metas, digests, cache_dir):
+    """Return the merged column metadata of multiple files (see `merge_column_metadata`).
+
+    The result is cached in `cache_dir` under a key made from the files' content hashes (`digests`),
+    and reused as long as none of the files change.
+    """
+    key = hashlib.sha256("".join(digests).encode()).hexdigest()
+    cache_path = Path(cache_dir) / f"metadata-{key[:16]}.json"
+    if cache_path.exists():
+        with open(cache_path, "r", encoding="utf-8") as fp:
+            column_metadata = json.load(fp)
+        # Json keys are strings.
+        for column_info in column_metadata.values():
+            if "Levels" in column_info:
+                column_info["Levels"] = {int(k): v for k, v in column_info["Levels"].items()}
+        return column_metadata
+
+    column_metadata = merge_column_metadata(metas)
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    for stale_path in cache_path.parent.glob("metadata-*.json"):
+        stale_path.unlink()
+    with open(cache_path, "w", encoding="utf-8") as fp:
+        json.dump(column_metadata, fp, ensure_ascii=True)
+    return column_metadata
+
+def _scale_problems(levels):
+    """Return {problem: boolean array over columns} for the scales in `levels`, all checked at once."""
+    import numpy as np
+
+    columns = [col for col in levels if levels[col]]
+    problems = {
+        "doesn't start at 1": np.zeros(len(columns), dtype=bool),
+        "is not in increasing order": np.zeros(len(columns), dtype=bool),
+        "is not linear": np.zeros(len(columns), dtype=bool),
+    }
+    if not columns:
+        return columns, problems
+    lengths = np.array([len(levels[col]) for col in columns])
+    codes = np.concatenate([list(levels[col]) for col in columns]).astype(float)
+    # Which column each code belongs to, and where each column starts.
+    column_index = np.repeat(np.arange(len(columns)), lengths)
+    starts = np.cumsum(lengths) - lengths
+    steps = np.diff(codes)
+    within_column = column_index[1:] == column_index[:-1]
+    problems["doesn't start at 1"] = codes[starts] != 1
+    problems["is not in increasing order"][column_index[1:][within_column & (steps <= 0)]] = True
+    problems["is not linear"][column_index[1:][within_column & (steps > 1)]] = True
+    return columns, problems
+
+def validate_levels(levels):
+    """Check that the codes of every scale in `levels` ({column: {code: label}}) start at 1 and increase by 1.
+
+    Sometimes when the Qualtrics question is edited the scale gets changed "unknowingly".
+    All scales are checked at once and every offending one is reported.
+    See `find_remappings` to recode them instead.
+    """
+    import numpy as np
+
+    columns, problems = _scale_problems(levels)
+    messages = [f"{columns[i]} scale {problem}." for problem, bad in problems.items() for i in np.flatnonzero(bad)]
+    assert not messages, " ".join(messages) + " Recode values in Qualtrics and re-export."
+
+def find_remappings(levels):
+    """Return {column: {old code: new code}} for scales in `levels` whose codes aren't 1, 2, 3... in order.
+
+    Those scales get recoded 1, 2, 3... in the order their levels are listed (the order they were shown),
+    e.g., when options were moved in Qualtrics and kept their original codes.
+    """
+    import numpy as np
+
+    columns, problems = _scale_problems(levels)
+    needs_remapping = np.logical_or.reduce(list(problems.values()))
+    return {
+        columns[i]: {int(old): new for new, old in enumerate(levels[columns[i]], start=1)}
+        for i in np.flatnonzero(needs_remapping)
+    }
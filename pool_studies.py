@@ -0,0 +1,51 @@
+"""Pool the raw data of multiple studies into one dataset.
+
+Each study (a profile under "studies" in the configuration file) has its own
+derivatives folder. This combines their raw data, with a new Study column, and
+exports it to the derivatives folder of "pooled_directory" laid out the same way,
+so it can be loaded like any single study's data.
+
+    $ python pool_studies.py                 # all studies
+    $ python pool_studies.py cohort1 cohort2
+"""
+import argparse
+from pathlib import Path
+import warnings
+
+import pandas as pd
+
+import metadata
+import utils
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Pool the raw data of multiple studies into one dataset.")
+    parser.add_argument("studies", nargs="*", default=utils.list_studies(), help="Studies to pool (default all).")
+    args = parser.parse_args()
+
+    config = utils.load_config()
+    export_path_data = Path(config["pooled_directory"]) / "derivatives" / "data.tsv"
+
+    dfs = {}
+    sidecars = {}
+    for study in args.studies:
+        df, sidecar = utils.load_raw(study=study)
+        dfs[study] = df.set_index("ParticipantID")
+        sidecars[study] = sidecar
+
+    # Studies follow the same protocol, so they should share their column info.
+    sidecar = metadata.Sidecar()
+    for study, study_sidecar in sidecars.items():
+        for col, column_info in study_sidecar.items():
+            if col in sidecar and sidecar[col] != column_info:
+                warnings.warn(f"{col} differs between studies, using the info from {list(sidecars)[0]}.")
+            sidecar.setdefault(col, column_info)
+
+    # Participant IDs are only unique within a study.
+    df = pd.concat(dfs, names=["Study", "ParticipantID"]).reset_index("Study")
+    df.index = pd.Index(df["Study"] + "_" + df.index, name="ParticipantID")
+    df = utils.compact_dtypes(df, sidecar).astype({"Study": "category"})
+
+    export_path_data.parent.mkdir(parents=True, exist_ok=True)
+    utils.save_raw(df, sidecar, export_path_data)
@@ -0,0 +1,222 @@
+"""Opt-in timing and memory instrumentation of the pipeline stages.
+
+Set the WAKEUP_PROFILE environment variable to profile any script (or all of them
+with `python runall.py --profile`). Each stage (the loaders, cleaning, scoring,
+stats and figure saving functions, and a few blocks in the scripts) then records
+its wall time, CPU time, peak memory above what was in use when it started
+(traced with tracemalloc), and row counts of the dataframes going in and out.
+Stages are written per script to derivatives/profile.json when the script ends.
+With WAKEUP_PROFILE=cprofile, a cProfile dump of the whole script is also saved
+to derivatives/profile-<script>.prof (open it with pstats or snakeviz).
+
+    $ WAKEUP_PROFILE=1 python source2raw.py
+    $ python runall.py --force --profile cprofile
+
+Tracing memory slows Python code down, so compare profiled runs with each other
+rather than with unprofiled ones. Stages in worker processes aren't recorded,
+only the stage that started them.
+"""
+from contextlib import contextmanager
+from datetime import datetime, timezone
+import functools
+import json
+import os
+from pathlib import Path
+import time
+
+
+ENV_VARIABLE = "WAKEUP_PROFILE"
+
+# Profiler of the script currently running, if profiling.
+_profiler = None
+
+
+class Profiler:
+    """Records the stages of one script run, see `stage`."""
+
+    def __init__(self, script, use_cprofile=False):
+        import cProfile
+        import tracemalloc
+
+        self.script = script
+        self.records = []
+        # Open stages, as [record, start of the stage's traced memory, highest traced memory so far].
+        self._open = []
+        self._was_tracing = tracemalloc.is_tracing()
+        if not self._was_tracing:
+            tracemalloc.start()
+        self._cprofile = cProfile.Profile() if use_cprofile else None
+        self._peak = 0
+        self._start = self._clock()
+        if self._cprofile is not None:
+            self._cprofile.enable()
+
+    @staticmethod
+    def _clock():
+        return time.perf_counter(), time.process_time()
+
+    def _update_peaks(self):
+        """Pass the traced memory peak since the last update on to every open stage, and restart it."""
+        import tracemalloc
+
+        peak = tracemalloc.get_traced_memory()[1]
+        self._peak = max(self._peak, peak)
+        for stage_info in self._open:
+            stage_info[2] = max(stage_info[2], peak)
+        tracemalloc.reset_peak()
+
+    def pause(self):
+        """Hand over to a profiler of a script run from within this one (see `Session.run` in utils)."""
+        self._update_peaks()
+        if self._cprofile is not None:
+            self._cprofile.disable()
+
+    def resume(self, inner):
+        """Take back over from the `inner` profiler once its script is done."""
+        self._peak = max(self._peak, inner._peak)
+        for stage_info in self._open:
+            stage_info[2] = max(stage_info[2], inner._peak)
+        if self._cprofile is not None:
+            self._cprofile.enable()
+
+    @contextmanager
+    def stage(self, name):
+        import tracemalloc
+
+        self._update_peaks()
+        record = dict(stage=name, depth=len(self._open))
+        self.records.append(record)
+        current = tracemalloc.get_traced_memory()[0]
+        stage_info = [record, current, current]
+        self._open.append(stage_info)
+        wall, cpu = self._clock()
+        try:
+            yield record
+        finally:
+            end_wall, end_cpu = self._clock()
+            self._update_peaks()
+            self._open.pop()
+            record["wall_seconds"] = round(end_wall - wall, 6)
+            record["cpu_seconds"] = round(end_cpu - cpu, 6)
+            record["peak_memory_mb"] = round((stage_info[2] - stage_info[1]) / 2**20, 3)
+
+    def stop(self, export_dir):
+        """Stop profiling, and add this run to profile.json (and save the cProfile dump) in `export_dir`."""
+        import tracemalloc
+
+        wall, cpu = self._clock()
+        if self._cprofile is not None:
+            self._cprofile.disable()
+        self._update_peaks()
+        if not self._was_tracing:
+            tracemalloc.stop()
+
+        export_dir = Path(export_dir)
+        export_dir.mkdir(parents=True, exist_ok=True)
+        run = {
+            "finished": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "wall_seconds": round(wall - self._start[0], 6),
+            "cpu_seconds": round(cpu - self._start[1], 6),
+            "peak_memory_mb": round(self._peak / 2**20, 3),
+            "cprofile": None,
+            "stages": self.records,
+        }
+        if self._cprofile is not None:
+            cprofile_path = export_dir / f"profile-{Path(self.script).stem}.prof"
+            self._cprofile.dump_stats(cprofile_path)
+            run["cprofile"] = cprofile_path.name
+        update_profile(export_dir / "profile.json", self.script, run)
+
+
+def enabled():
+    """Return True if profiling is switched on by the environment variable."""
+    return os.environ.get(ENV_VARIABLE, "").lower() not in ["", "0", "false", "no", "off"]
+
+def start(script):
+    """Start profiling `script` if switched on, returning the previous profiler to restore with `stop`."""
+    global _profiler
+    previous = _profiler
+    if enabled():
+        if previous is not None:
+            previous.pause()
+        _profiler = Profiler(script, use_cprofile=os.environ[ENV_VARIABLE].lower() == "cprofile")
+    return previous
+
+def stop(export_dir, previous=None):
+    """Stop profiling the current script (see `Profiler.stop`), and go back to the `previous` profiler."""
+    global _profiler
+    profiler, _profiler = _profiler, previous
+    if profiler is not None and profiler is not previous:
+        profiler.stop(export_dir)
+        if previous is not None:
+            previous.resume(profiler)
+
+@contextmanager
+def stage(name, rows_in=None):
+    """Record a stage of the current script if profiling, yielding its record to add info to.
+
+    Set "rows_out" (or other counts) on the record inside the block, e.g.,
+
+        with profiling.stage("merge", rows_in=len(df)) as record:
+            df = ...
+            record["rows_out"] = len(df)
+    """
+    if _profiler is None:
+        yield {}
+        return
+    with _profiler.stage(name) as record:
+        if rows_in is not None:
+            record["rows_in"] = rows_in
+        yield record
+
+def count_rows(obj):
+    """Return the number of rows of a dataframe or series (or the first one in a tuple), else None."""
+    if isinstance(obj, tuple) and obj:
+        obj = obj[0]
+    if hasattr(obj, "shape") and hasattr(obj, "index"):
+        return len(obj)
+    return None
+
+def profiled(func):
+    """Decorate `func` so each call is recorded as a stage, with the rows of its first argument and result."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if _profiler is None:
+            return func(*args, **kwargs)
+        rows_in = count_rows(args[0]) if args else None
+        with stage(func.__qualname__, rows_in=rows_in) as record:
+            result = func(*args, **kwargs)
+            rows_out = count_rows(result)
+            if rows_out is not None:
+                record["rows_out"] = rows_out
+        return result
+    return wrapper
+
+def update_profile(filepath, script, run, timeout=60):
+    """Set the latest `run` of `script` in a profile json file.
+
+    Scripts run in parallel share the file, so it's locked while being rewritten.
+    """
+    filepath = Path(filepath)
+    lock_path = filepath.with_suffix(".lock")
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            lock = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            assert time.monotonic() < deadline, f"Timed out waiting for {lock_path}, remove it if stale."
+            time.sleep(0.05)
+    try:
+        profile = {}
+        if filepath.exists():
+            with open(filepath, "r", encoding="utf-8") as fp:
+                profile = json.load(fp)
+        profile[script] = run
+        tmp_path = filepath.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as fp:
+            json.dump(profile, fp, indent=4)
+        os.replace(tmp_path, filepath)
+    finally:
+        os.close(lock)
+        os.unlink(lock_path)
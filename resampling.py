@@ -0,0 +1,161 @@
+"""Permutation tests and bootstrap confidence intervals.
+
+Replicates are drawn as index matrices and evaluated in vectorized batches
+rather than one at a time. Statistic functions take two 2D arrays
+(replicates x observations) and return one value per replicate.
+
+Each batch gets its own child seed, so results only depend on the seed
+and batch size, not on how many processes the batches are spread across.
+With `n_jobs` > 1 the batches run in a process pool, which on platforms
+that spawn (rather than fork) new processes requires the calling script
+to be importable without side effects.
+"""
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import profiling
+import utils
+
+
+# Most contingency table cells `kendall_statistic` counts at once (8 bytes each).
+MAX_TABLE_CELLS = 10**6
+
+
+################################################################################
+# STATISTICS
+################################################################################
+
+def chi2_statistic(x, y):
+    """Pearson chi-square statistic (no continuity correction) of two binary variables."""
+    x = x.astype(bool)
+    y = y.astype(bool)
+    n = x.shape[-1]
+    x_totals = x.sum(axis=-1)
+    y_totals = y.sum(axis=-1)
+    observed = np.stack([
+        (x & y).sum(axis=-1),
+        (x & ~y).sum(axis=-1),
+        (~x & y).sum(axis=-1),
+        (~x & ~y).sum(axis=-1),
+    ], axis=-1)
+    expected = np.stack([
+        x_totals * y_totals,
+        x_totals * (n - y_totals),
+        (n - x_totals) * y_totals,
+        (n - x_totals) * (n - y_totals),
+    ], axis=-1) / n
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return ((observed - expected) ** 2 / expected).sum(axis=-1)
+
+def cramers_v(x, y):
+    """Cramer's V (phi) effect size of two binary variables."""
+    n = x.shape[-1]
+    return np.sqrt(chi2_statistic(x, y) / n)
+
+def slope_statistic(x, y):
+    """Ordinary least squares slope of `y` regressed on `x`."""
+    x_centered = x - x.mean(axis=-1, keepdims=True)
+    y_centered = y - y.mean(axis=-1, keepdims=True)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return (x_centered * y_centered).sum(axis=-1) / (x_centered ** 2).sum(axis=-1)
+
+def kendall_statistic(x, y):
+    """Kendall's tau-b, from a contingency table of each replicate's values.
+
+    Replicates are counted into tables a chunk at a time, so memory stays under
+    `MAX_TABLE_CELLS` whatever the number of replicates. Data with so many distinct
+    values that a single table is over that fall back to scipy's O(n log n) tau-b
+    one replicate at a time.
+    """
+    n = x.shape[-1]
+    x_levels, x_codes = np.unique(x, return_inverse=True)
+    y_levels, y_codes = np.unique(y, return_inverse=True)
+    kx, ky = x_levels.size, y_levels.size
+    x_codes = x_codes.reshape(x.shape)
+    y_codes = y_codes.reshape(y.shape)
+    if kx * ky > MAX_TABLE_CELLS:
+        from scipy.stats import kendalltau
+
+        return np.array([kendalltau(xi, yi).statistic for xi, yi in zip(x_codes, y_codes)])
+
+    n_replicates = x_codes.shape[0]
+    chunk_size = MAX_TABLE_CELLS // (kx * ky)
+    con_minus_dis = np.empty(n_replicates, dtype=np.int64)
+    x_ties = np.empty(n_replicates, dtype=np.int64)
+    y_ties = np.empty(n_replicates, dtype=np.int64)
+    for start in range(0, n_replicates, chunk_size):
+        chunk = slice(start, start + chunk_size)
+        cells = x_codes[chunk] * ky + y_codes[chunk]
+        replicate_offsets = (np.arange(cells.shape[0]) * kx * ky)[:, None]
+        tables = np.bincount(
+            (replicate_offsets + cells).ravel(), minlength=cells.shape[0] * kx * ky
+        ).reshape(-1, kx, ky)
+        con_minus_dis[chunk] = utils.concordance_difference(tables)
+        # Pairs tied on each variable.
+        x_counts = tables.sum(axis=2)
+        y_counts = tables.sum(axis=1)
+        x_ties[chunk] = (x_counts * (x_counts - 1)).sum(axis=1) // 2
+        y_ties[chunk] = (y_counts * (y_counts - 1)).sum(axis=1) // 2
+    total = n * (n - 1) // 2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return con_minus_dis / np.sqrt((total - x_ties) * (total - y_ties).astype(float))
+
+
+################################################################################
+# RESAMPLING
+################################################################################
+
+def _permutation_batch(task):
+    """Evaluate `statistic` with `y` shuffled relative to `x`."""
+    statistic, x, y, size, seed = task
+    rng = np.random.default_rng(seed)
+    indices = rng.permuted(np.tile(np.arange(y.size), (size, 1)), axis=1)
+    return statistic(np.broadcast_to(x, indices.shape), y[indices])
+
+def _bootstrap_batch(task):
+    """Evaluate `statistic` on observations resampled with replacement."""
+    statistic, x, y, size, seed = task
+    rng = np.random.default_rng(seed)
+    indices = rng.integers(0, x.size, size=(size, x.size))
+    return statistic(x[indices], y[indices])
+
+def _resample(batch_func, statistic, x, y, n_resamples, batch_size, seed, n_jobs):
+    """Split `n_resamples` into batches, each with its own seed, and run them."""
+    x = np.asarray(x)
+    y = np.asarray(y)
+    assert x.shape == y.shape and x.ndim == 1, "x and y must be 1D and the same length."
+    n_batches = -(-n_resamples // batch_size)
+    sizes = [batch_size] * (n_batches - 1) + [n_resamples - batch_size * (n_batches - 1)]
+    seeds = np.random.SeedSequence(seed).spawn(n_batches)
+    tasks = [(statistic, x, y, size, s) for size, s in zip(sizes, seeds)]
+    if n_jobs == 1:
+        results = list(map(batch_func, tasks))
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            results = list(executor.map(batch_func, tasks))
+    return np.concatenate(results)
+
+@profiling.profiled
+def permutation_test(x, y, statistic, n_resamples=10000, batch_size=1000, seed=None, n_jobs=1):
+    """Return the observed statistic and its two-sided permutation p-value.
+
+    The p-value counts the observed arrangement as one of the permutations,
+    so it is never zero.
+    """
+    observed = statistic(np.asarray(x)[None], np.asarray(y)[None])[0]
+    null = _resample(_permutation_batch, statistic, x, y, n_resamples, batch_size, seed, n_jobs)
+    # Small tolerance so permutations identical to the observed data count as extreme.
+    n_extreme = np.sum(np.abs(null) >= np.abs(observed) * (1 - 1e-12))
+    pval = (n_extreme + 1) / (n_resamples + 1)
+    return observed, pval
+
+@profiling.profiled
+def bootstrap_ci(x, y, statistic, confidence=0.95, n_resamples=10000, batch_size=1000, seed=None, n_jobs=1):
+    """Return the percentile bootstrap confidence interval of `statistic` as a [low, high] array.
+
+    Resamples where the statistic is undefined (e.g., no variance) are ignored.
+    """
+    replicates = _resample(_bootstrap_batch, statistic, x, y, n_resamples, batch_size, seed, n_jobs)
+    alpha = (1 - confidence) / 2
+    return np.nanquantile(replicates, [alpha, 1 - alpha])
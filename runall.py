@@ -0,0 +1,229 @@
+"""Run all scripts to reproduce results.
+
+Each script only reruns if one of its inputs (code, config, or data files)
+changed since its last successful run, or if one of its outputs is missing.
+Scripts run in parallel processes as soon as the scripts they depend on finish,
+or one after another in this interpreter with --single-process, which avoids
+restarting Python and reloading the data for every script.
+
+With multiple study profiles in the configuration file, --study picks which
+studies to run (the default study otherwise), and --all-studies runs all of them
+at once and then pools their data (see pool_studies.py).
+
+    $ python runall.py                    # rerun what changed
+    $ python runall.py --force            # rerun everything
+    $ python runall.py --single-process   # rerun what changed, in one process
+    $ python runall.py --all-studies      # rerun what changed in every study, and pool them
+    $ python runall.py --force --profile  # rerun everything, recording where time and memory go
+"""
+import argparse
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+import json
+import os
+from pathlib import Path
+import subprocess
+import sys
+
+import profiling
+import utils
+
+
+def build_steps(config):
+    """Return each script's inputs, outputs and the scripts it depends on.
+
+    Source data inputs are the exports selected by the configuration, with their hashes
+    from the source manifest as "known_hashes" so they aren't hashed again.
+    """
+    root_dir = Path(config["root_directory"])
+    source_dir = root_dir / "sourcedata"
+    deriv_dir = root_dir / "derivatives"
+    raw_data = [deriv_dir / "data.tsv", deriv_dir / "data.json", deriv_dir / "data.parquet"]
+    code = ["utils.py", "metadata.py", "profiling.py", "config.json"]
+
+    def plots(stem):
+        return [deriv_dir / f"{stem}-plot.{fmt}" for fmt in config["figure_formats"]]
+
+    sources = {}
+    for which in utils.SOURCE_PATTERNS:
+        entry = utils.select_qualtrics_export(which, study=config.get("study"))
+        sources[str(source_dir / entry["filename"])] = entry["sha256"]
+
+    return {
+        # Clean and aggregate raw Qualtrics output.
+        "source2raw.py": dict(
+            inputs=code + list(sources),
+            outputs=raw_data + [deriv_dir / "exclusions.tsv"],
+            depends=[],
+            known_hashes=sources,
+        ),
+        # Describe the sample.
+        "demographics.py": dict(
+            inputs=code + raw_data,
+            outputs=[deriv_dir / "demographics.tsv", deriv_dir / "demographics_freq.tsv"],
+            depends=["source2raw.py"],
+        ),
+        # Inspect correlated measures.
+        "corr_table.py": dict(
+            inputs=code + raw_data,
+            outputs=[deriv_dir / "corr_table.png", deriv_dir / "corr_table.tsv"],
+            depends=["source2raw.py"],
+        ),
+        # Did participants think the wakeup tasks impacted their awakening?
+        "wakeup_impact.py": dict(
+            inputs=code + ["resampling.py"] + raw_data,
+            outputs=plots("wakeup_impact") + [deriv_dir / "wakeup_impact-freq.tsv", deriv_dir / "wakeup_impact-stat.tsv"],
+            depends=["source2raw.py"],
+        ),
+        # Did participants wake up sooner after the wakeup tasks?
+        "wakeup_timing.py": dict(
+            inputs=code + ["resampling.py"] + raw_data,
+            outputs=plots("wakeup_timing") + [deriv_dir / "wakeup_timing-freq.tsv", deriv_dir / "wakeup_timing-stat.tsv"],
+            depends=["source2raw.py"],
+        ),
+        # Did lucidity levels during wakeup tasks predict success?
+        "wakeup_lucidity.py": dict(
+            inputs=code + ["resampling.py"] + raw_data,
+            outputs=plots("wakeup_lucidity") + [deriv_dir / "wakeup_lucidity-desc.tsv", deriv_dir / "wakeup_lucidity-stat.tsv"],
+            depends=["source2raw.py"],
+        ),
+        # Did dream control (more generally) predict a change in dream emotion?
+        "control_emotion.py": dict(
+            inputs=code + ["resampling.py"] + raw_data,
+            outputs=plots("control_emotion") + [deriv_dir / "control_emotion-desc.tsv", deriv_dir / "control_emotion-stat.tsv"],
+            depends=["source2raw.py"],
+        ),
+    }
+
+def hash_inputs(script, inputs, known_hashes={}):
+    """Return a dict of content hashes for the script and all its inputs (glob patterns are expanded).
+
+    Inputs in `known_hashes` (path: hash) take the given hash instead of being hashed.
+    """
+    paths = [Path(script)]
+    for pattern in map(Path, inputs):
+        if any(char in pattern.name for char in "*?["):
+            paths.extend(sorted(pattern.parent.glob(pattern.name)))
+        else:
+            paths.append(pattern)
+    hashes = {}
+    for p in paths:
+        if str(p) in known_hashes:
+            hashes[str(p)] = known_hashes[str(p)]
+        else:
+            hashes[str(p)] = utils.file_hash(p) if p.exists() else None
+    return hashes
+
+def build_pooled_step(config, studies):
+    """Return the inputs, outputs and dependencies of pooling the data of `studies`."""
+    pooled_data = Path(config["pooled_directory"]) / "derivatives" / "data.tsv"
+    inputs = ["utils.py", "metadata.py", "profiling.py", "config.json"]
+    depends = []
+    for study in studies:
+        raw_data = Path(utils.load_config(study)["root_directory"]) / "derivatives" / "data.parquet"
+        inputs.append(raw_data)
+        depends.append((study, "source2raw.py"))
+    return dict(
+        inputs=inputs,
+        outputs=[pooled_data.with_suffix(ext) for ext in [".tsv", ".json", ".parquet"]],
+        depends=depends,
+    )
+
+def run_script(script, args=(), study=None):
+    """Run a script in its own interpreter (with the settings of `study` if given), returning its exit code."""
+    env = dict(os.environ)
+    if study is not None:
+        env[utils.STUDY_VARIABLE] = study
+    return subprocess.run([sys.executable, script, *args], env=env).returncode
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Run all scripts to reproduce results.")
+    parser.add_argument("--force", action="store_true", help="Rerun all scripts, even if inputs are unchanged.")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="Maximum number of scripts run at once.")
+    parser.add_argument("--single-process", action="store_true", help="Run scripts sequentially in this interpreter.")
+    parser.add_argument("--study", action="append", help="Study to run, can be given multiple times.")
+    parser.add_argument("--all-studies", action="store_true", help="Run all studies and pool their data.")
+    parser.add_argument("--profile", nargs="?", const="1", choices=["1", "cprofile"],
+        help="Record the stages of each script in profile.json (see profiling.py), with cProfile dumps if cprofile.")
+    args = parser.parse_args()
+
+    # Scripts (in this or other processes) profile themselves when the variable is set.
+    if args.profile:
+        os.environ[profiling.ENV_VARIABLE] = args.profile
+
+    studies = (utils.list_studies() if args.all_studies else args.study) or [None]
+
+    # Steps of all studies, each keyed by (study, script) and saving its state in its study's derivatives.
+    steps = {}
+    for study in studies:
+        config = utils.load_config(study)
+        state_path = Path(config["root_directory"]) / "derivatives" / "runall.json"
+        for script, step in build_steps(config).items():
+            step["depends"] = [(study, d) for d in step["depends"]]
+            steps[study, script] = dict(step, args=[], state_path=state_path)
+    if len(studies) > 1:
+        config = utils.load_config()
+        state_path = Path(config["pooled_directory"]) / "derivatives" / "runall.json"
+        steps[None, "pool_studies.py"] = dict(build_pooled_step(config, studies), args=studies, state_path=state_path)
+
+    # Last successful run of each script, by state file.
+    states = {}
+    for state_path in {step["state_path"] for step in steps.values()}:
+        states[state_path] = {}
+        if state_path.exists() and not args.force:
+            with open(state_path, "r", encoding="utf-8") as fp:
+                states[state_path] = json.load(fp)
+
+    if args.single_process:
+        session = utils.Session()
+
+    def launch(executor, study, script, script_args):
+        """Start a script, returning a future of its exit code."""
+        print(f"Running {script}" + (f" ({study})" if study else ""), flush=True)
+        if not args.single_process:
+            return executor.submit(run_script, script, script_args, study)
+        future = Future()
+        future.set_result(session.run(script, script_args, study))
+        return future
+
+    pending = dict(steps)
+    done = set()
+    running = {}
+    failed = []
+    with ThreadPoolExecutor(max_workers=args.jobs) as executor:
+        while pending or running:
+            # Start every script whose dependencies have finished.
+            if not failed:
+                ready = [key for key, step in pending.items() if all(d in done for d in step["depends"])]
+                for key in ready:
+                    study, script = key
+                    step = pending.pop(key)
+                    state = states[step["state_path"]]
+                    # Hash now, since inputs can be outputs of a dependency that just ran.
+                    hashes = hash_inputs(script, step["inputs"], step.get("known_hashes", {}))
+                    outputs_exist = all(Path(p).exists() for p in step["outputs"])
+                    if state.get(script) == hashes and outputs_exist:
+                        print(f"Skipping {script}" + (f" ({study})" if study else "") + " (unchanged)", flush=True)
+                        done.add(key)
+                    else:
+                        running[launch(executor, study, script, step["args"])] = (key, hashes)
+                if ready and not running:
+                    continue
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                key, hashes = running.pop(future)
+                if future.result() != 0:
+                    failed.append(" ".join(filter(None, key[::-1])))
+                    continue
+                done.add(key)
+                state_path = steps[key]["state_path"]
+                states[state_path][key[1]] = hashes
+                state_path.parent.mkdir(parents=True, exist_ok=True)
+                with open(state_path, "w", encoding="utf-8") as fp:
+                    json.dump(states[state_path], fp, indent=4)
+
+    if failed:
+        sys.exit(f"Failed: {', '.join(failed)}")
@@ -1,13 +1,20 @@
 """
 Merge the 2 source data files (Initial Survey and Morning Report)
 into 1 tsv file. Source files are exported as SPSS from Qualtrics.
+
+If "incremental_build" is true in the configuration file, only participants
+with responses recorded since the last build are processed and merged into
+the previous output. A full rebuild still happens if the collection windows,
+participant ID fixes, or code changed since the last build.
 """
+import hashlib
 import json
 from pathlib import Path
 
 import numpy as np
 import pandas as pd
 
+import metadata
 import utils
 
 
@@ -17,46 +24,113 @@ import utils
 
 # Load variables from configuration file.
 config = utils.load_config()
-round1_start = config["round1_start_timestamp"]
-round1_end = config["round1_end_timestamp"]
-round2_start = config["round2_start_timestamp"]
-round2_end = config["round2_end_timestamp"]
+collection_rounds = utils.parse_collection_rounds(config["collection_rounds"])
 root_dir = Path(config["root_directory"])
 
 # Choose export path.
 export_path_data = root_dir / "derivatives" / "data.tsv"
-export_path_sidecar = export_path_data.with_suffix(".json")
+export_path_columnar = export_path_data.with_suffix(".parquet")
+export_path_build = root_dir / "derivatives" / "data_build.json"
+export_path_exclusions = root_dir / "derivatives" / "exclusions.tsv"
+
+# Participant ID typos in the morning report that could be traced back,
+# and those that couldn't and need to be removed (specific to each study).
+morning_id_replacements = {int(k): v for k, v in config.get("morning_id_replacements", {}).items()}
+morning_id_removals = config.get("morning_id_removals", [])
+
+# Participant eligibility, on top of standard Qualtrics cleaning.
+# Reduce entries to those only within the data collection windows.
+morning_filters = [("StartDate", "in rounds", collection_rounds)]
+# Remove participants who did not consent or are ineligible.
+initial_filters = morning_filters + [
+    ("Consent", "==", 1),  # Said yes to consent form
+    ("age", ">", 1),  # 18 or older
+    ("Instructions", "in", [1, 2]),  # Expressed interest in continuing to second part
+]
 
-# Load all data and metadata.
-initial_df, initial_meta = utils.load_qualtrics_source("initial")
-morning_df, morning_meta = utils.load_qualtrics_source("morning")
+# Load all data and metadata, and remove pilot participants and incomplete surveys.
+# Both sources are independent until merged, so they are handled in parallel if n_jobs > 1.
+# RecordedDate is kept for incremental builds.
+sources = utils.load_clean_qualtrics_sources(
+    ["initial", "morning"], keep_columns=["StartDate", "RecordedDate"], n_jobs=config.get("n_jobs", 1)
+)
+initial_df, initial_meta, initial_exclusions = sources["initial"]
+morning_df, morning_meta, morning_exclusions = sources["morning"]
+# Column info from file metadata, merged from both files (initial survey first) and cached until either changes.
+column_metadata = metadata.load_column_metadata(
+    [initial_meta, morning_meta],
+    [utils.select_qualtrics_export(which)["sha256"] for which in ["initial", "morning"]],
+    cache_dir=root_dir / "derivatives" / "cache",
+)
 
 
 ################################################################################
-# PARTICIPANT REMOVAL
+# INCREMENTAL BUILD
 ################################################################################
 
-# Remove pilot participants and incomplete surveys.
-initial_df = utils.standard_qualtrics_clean(initial_df, keep_columns=["StartDate"])
-morning_df = utils.standard_qualtrics_clean(morning_df, keep_columns=["StartDate"])
-# Reduce entries to those only within the 2 data collection windows.
-initial_df = initial_df[
-    initial_df["StartDate"].between(round1_start, round1_end)
-    |
-    initial_df["StartDate"].between(round2_start, round2_end)
-]
-morning_df = morning_df[
-    morning_df["StartDate"].between(round1_start, round1_end)
-    |
-    morning_df["StartDate"].between(round2_start, round2_end)
-]
+# Anything that would change already-processed participants requires a full rebuild.
+build_settings = {
+    "rounds": collection_rounds.tolist(),
+    "morning_id_replacements": {str(k): v for k, v in morning_id_replacements.items()},
+    "morning_id_removals": morning_id_removals,
+    "column_metadata": column_metadata,  # Likert recoding depends on it
+    # Pinning an older export (see "source_versions") would leave out responses already processed.
+    "sources": {which: utils.select_qualtrics_export(which)["sha256"] for which in ["initial", "morning"]},
+    "code": [utils.file_hash(__file__), utils.file_hash(utils.__file__), utils.file_hash(metadata.__file__)],
+}
+build_fingerprint = hashlib.sha256(json.dumps(build_settings, sort_keys=True).encode()).hexdigest()
+
+build_state = None
+if config.get("incremental_build", False) and export_path_build.exists() and export_path_columnar.exists():
+    with open(export_path_build, "r", encoding="utf-8") as fp:
+        build_state = json.load(fp)
+    if build_state["fingerprint"] != build_fingerprint:
+        print("Collection windows, participant ID fixes, or code changed, running a full rebuild.")
+        build_state = None
+incremental = build_state is not None
+
+# Most recent response of each source, where the next incremental build picks up from.
+# None if a source has no responses yet, so all of its responses are new next time.
+recorded_until = {
+    which: None if df.empty else str(df["RecordedDate"].max())
+    for which, df in [("initial", initial_df), ("morning", morning_df)]
+}
 
-# Remove participants who did not consent or are ineligible.
-initial_df = (
-    initial_df
-    .query("Consent.eq(1)")  # Said yes to consent form
-    .query("age.gt(1)")  # 18 or older
-    .query("Instructions.isin([1, 2])")  # Expressed interest in continuing to second part
+if incremental:
+    # Reduce both sources to all responses of participants with a response since the last build.
+    initial_ids = pd.to_numeric(initial_df["ParticipantID"], errors="coerce")
+    morning_ids = pd.to_numeric(morning_df["ParticipantID"], errors="coerce").replace(morning_id_replacements)
+    updated_ids = set()
+    for ids, df, which in [(initial_ids, initial_df, "initial"), (morning_ids, morning_df, "morning")]:
+        # All responses are new for a source that had none at the last build.
+        until = build_state["recorded_until"][which]
+        is_new = df["RecordedDate"].gt(pd.Timestamp(until)) if until is not None else pd.Series(True, index=df.index)
+        updated_ids |= set(ids[is_new].dropna())
+    initial_df = initial_df[initial_ids.isin(updated_ids)]
+    morning_df = morning_df[morning_ids.isin(updated_ids)]
+    print(f"Incremental build, updating {len(updated_ids)} participant(s).")
+
+
+################################################################################
+# PARTICIPANT REMOVAL
+################################################################################
+
+# Pilot participants and incomplete surveys were removed when loading.
+initial_df = initial_df.drop(columns="RecordedDate")
+morning_df = morning_df.drop(columns="RecordedDate")
+# Remove those outside collection windows or ineligible (all filters applied at once).
+initial_df, n_removed = utils.filter_rows(initial_df, initial_filters)
+initial_exclusions.update(n_removed)
+morning_df, n_removed = utils.filter_rows(morning_df, morning_filters)
+morning_exclusions.update(n_removed)
+
+# Number of responses removed at each step, in order.
+exclusions = pd.concat(
+    {
+        "initial": pd.Series(initial_exclusions, name="n_removed"),
+        "morning": pd.Series(morning_exclusions, name="n_removed"),
+    },
+    names=["source", "criterion"],
 )
 
 
@@ -69,10 +143,8 @@ initial_df["ParticipantID"] = initial_df["ParticipantID"].astype(int)
 morning_df["ParticipantID"] = morning_df["ParticipantID"].astype(int)
 
 # Fix participant typos.
-morning_id_replacements = {195811: 194811}
 morning_df["ParticipantID"] = morning_df["ParticipantID"].replace(morning_id_replacements)
 # Remove those who typoed and can't be traced back.
-morning_id_removals = [601519]
 morning_df = morning_df[~morning_df["ParticipantID"].isin(morning_id_removals)]
 
 # Someone filled out the morning report multiple times. Keep just the first.
@@ -101,7 +173,7 @@ df.insert(0, "Completed_part2", df.index.isin(morning_df.index))
 df = df.sort_values("Completed_part2", ascending=False)
 
 # Prepend Participant IDs with letters so they are obviously categorical.
-df.index = df.index.map(lambda x: f"sub-{x}")
+df.index = "sub-" + df.index.astype(str)
 
 
 ################################################################################
@@ -114,95 +186,80 @@ df.index = df.index.map(lambda x: f"sub-{x}")
 # !! Remappings must be applied before deriving aggregate scale scores.
 
 ## Start the sidecar with general info but extract the column info from file metadata.
-sidecar = {
+sidecar = metadata.Sidecar({
     "MeasurementToolMetadata": {
         "Description": "Series of custom questionnaires"
     }
-}
-
-likert_remappings = {}
-
-for col in df:
-    column_info = {}
-    probe = None
-    levels = None
-
-    # Get probe string (if present).
-    if col in initial_meta.column_names_to_labels:
-        probe = initial_meta.column_names_to_labels[col]
-    elif col in morning_meta.column_names_to_labels:
-        probe = morning_meta.column_names_to_labels[col]
-    # Get response option strings (if present).
-    if col in initial_meta.variable_value_labels:
-        levels = initial_meta.variable_value_labels[col]
-    elif col in morning_meta.variable_value_labels:
-        levels = morning_meta.variable_value_labels[col]
-    
-    if probe is not None:
-        column_info["Probe"] = probe
-    if levels is not None:
-        # values = list(levels.keys())
-        # if ((values[0] != 1)
-        #     or values != sorted(values)
-        #     or np.any(np.diff(values) != 1)):
-        #     new_values = range(1, len(values)+1)
-        #     levels = { k: v for k, v in zip(new_values, levels.values()) }
-        #     likert_remappings[col] = { x: y for x, y in zip(values, new_values) }
-        # levels = { int(k): v for k, v in levels.items() }
-        if not col.startswith("Email"):
-            if col in initial_meta.column_names_to_labels:
-                utils.validate_likert_scales(initial_meta, col)
-            else:
-                utils.validate_likert_scales(morning_meta, col)
-        levels = { int(k): v for k, v in levels.items() }
-        column_info["Levels"] = levels
-
-    if column_info:
-        sidecar[col] = column_info
-
-# Apply remappings.
+})
+sidecar.update({col: column_metadata[col] for col in df if col in column_metadata})
+
+# The Email columns are checkboxes, which must be coded 1 when checked rather than recoded.
+email_columns = [col for col in sidecar.likert_columns if col.startswith("Email")]
+metadata.validate_levels({col: sidecar[col]["Levels"] for col in email_columns})
+
+# Find Likert scales that don't run 1, 2, 3... in order,
+# recode them all at once, and note the recoding in the sidecar.
+likert_remappings = metadata.find_remappings({
+    col: sidecar[col]["Levels"] for col in sidecar.likert_columns if col not in email_columns
+})
 for col, remap in likert_remappings.items():
-    df[col] = df[col].replace(remap)
+    print(f"Recoding {col} scale {list(remap)} to {list(remap.values())}.")
+    levels = {remap[k]: v for k, v in sidecar[col]["Levels"].items()}
+    sidecar[col] = {**sidecar[col], "Levels": levels, "Remapping": remap}
+df = utils.remap_codes(df, likert_remappings)
+
+# Everything is float or object after merging, store Likert and categorical columns compactly.
+df = utils.compact_dtypes(df, sidecar)
 
 
 ################################################################################
 # CALCULATE AGGREGATED SURVEY SCORES
 ################################################################################
 
-def imputed_sum(row, cutoff=0.5):
-    """Return imputed sum if proportion of values that are missing are greater than `cutoff`."""
-    return np.nan if row.isna().mean() > cutoff else row.fillna(row.mean()).sum()
-
-def imputed_mean(row, cutoff=0.5):
-    return np.nan if row.isna().mean() > cutoff else row.fillna(row.mean()).mean()
-
-# Aggregate trait LUSK from initial survey.
+# Scale definitions, scored in one pass with missing items imputed from the row mean.
+# Item columns are collected before any scores are added (so "LUSK" doesn't match itself).
+POS_PANAS = [1, 3, 5, 9, 10, 12, 14, 16, 17, 19]
 lusk_columns = [c for c in df if c.startswith("LUSK")]
-df["LUSK"] = df[lusk_columns].apply(imputed_mean, axis=1)
-
-# Aggregate dream-specific state LUSK from morning report.
 dream_lusk_columns = [c for c in df if c.startswith("Dream_LUSK")]
-df["Dream_LUSK"] = df[dream_lusk_columns].apply(imputed_mean, axis=1)
-
-# Aggregate dream-specific PANAS from morning report.
-POS_PANAS = [1, 3, 5, 9, 10, 12, 14, 16, 17, 19]
 panas_columns = [c for c in df if c.startswith("PANAS")]
 pos_panas_columns = [c for c in panas_columns if int(c.split("_")[-1]) in POS_PANAS]
 neg_panas_columns = [c for c in panas_columns if c not in pos_panas_columns]
-df["PANAS_pos"] = df[pos_panas_columns].apply(imputed_sum, axis=1)
-df["PANAS_neg"] = df[neg_panas_columns].apply(imputed_sum, axis=1)
+scales = {
+    "LUSK": {"items": lusk_columns, "method": "mean"},  # trait LUSK from initial survey
+    "Dream_LUSK": {"items": dream_lusk_columns, "method": "mean"},  # dream-specific LUSK from morning report
+    "PANAS_pos": {"items": pos_panas_columns, "method": "sum"},  # dream-specific PANAS from morning report
+    "PANAS_neg": {"items": neg_panas_columns, "method": "sum"},
+}
+scores = utils.score_scales(df, scales, cutoff=0.5)
+df = pd.concat([df, scores], axis=1)
 
 # Drop unneccessary columns.
 drop_columns = ["Email", "Consent", "Instructions"]
 # drop_columns = drop_columns + lusk_columns + dream_lusk_columns + panas_columns
 df = df.drop(columns=drop_columns)
-sidecar = {k: v for k, v in sidecar.items() if k in df or k == "MeasurementToolMetadata"}
+sidecar = metadata.Sidecar({k: v for k, v in sidecar.items() if k in df or k == sidecar.DESCRIPTION_KEY})
+
+if incremental:
+    # Replace the updated participants in the previous build.
+    previous_df = pd.read_parquet(export_path_columnar).set_index("ParticipantID")
+    previous_df = previous_df.drop(index=[f"sub-{x:.0f}" for x in updated_ids], errors="ignore")
+    df = pd.concat([previous_df, df], verify_integrity=True)
+    df = df.sort_values("Completed_part2", ascending=False, kind="stable")
+    # Categoricals with different categories don't survive concatenation.
+    df = utils.compact_dtypes(df, sidecar)
 
 
 ################################################################################
 # EXPORT
 ################################################################################
 
-df.to_csv(export_path_data, index=True, na_rep="n/a", float_format="%.3f", sep="\t")
-with open(export_path_sidecar, "w", encoding="utf-8") as fp:
-    json.dump(sidecar, fp, indent=4, sort_keys=False, ensure_ascii=True)
+# The tsv, its typed columnar copy, and the sidecar.
+utils.save_raw(df, sidecar, export_path_data)
+
+# Only a full build sees all responses, so only then is the exclusion report complete.
+if not incremental:
+    exclusions.to_csv(export_path_exclusions, index=True, sep="\t")
+
+# Save where this build left off, for the next incremental build.
+with open(export_path_build, "w", encoding="utf-8") as fp:
+    json.dump({"fingerprint": build_fingerprint, "recorded_until": recorded_until}, fp, indent=4)
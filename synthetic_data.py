@@ -0,0 +1,181 @@
+"""Generate synthetic Qualtrics exports, for testing and benchmarking without the real data.
+
+Writes an Initial questionnaire and a Morning report SPSS file to the sourcedata
+folder of a study root directory, with the same columns, value labels and probes
+that source2raw.py and the other scripts expect. Responses are random, but start
+times fall in the configured collection rounds, about half of eligible participants
+return for the morning report, and a few responses are previews or unfinished so
+the cleaning steps have something to remove.
+
+    $ python synthetic_data.py 1000 ../synthetic
+    $ python synthetic_data.py 1000000 ../synthetic --seed 2
+"""
+import argparse
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyreadstat
+
+import utils
+
+
+AGREEMENT = {1: "Strongly disagree", 2: "Disagree", 3: "Neutral", 4: "Agree", 5: "Strongly agree"}
+RECALL = {
+    1: "Never", 2: "Less than once a month", 3: "About once a month", 4: "2-3 times a month",
+    5: "About once a week", 6: "Several times a week", 7: "Almost every night",
+}
+INTENSITY = {1: "Not at all", 2: "A little", 3: "Moderately", 4: "Quite a bit", 5: "Extremely"}
+
+# Response levels of each survey item.
+INITIAL_LEVELS = {
+    "Consent": {1: "I agree", 2: "I do not agree"},
+    "age": {1: "Under 18", 2: "18-24", 3: "25-34", 4: "35 or older"},
+    "Instructions": {1: "Yes, this week", 2: "Yes, later", 3: "No"},
+    "Email_other_1": {1: "Similar lucid dreaming study opportunities in the future"},
+    "Email_other_2": {1: "Any published work that comes from this current study"},
+    "Email_other_4": {1: "Weekly reminders to complete the second part"},
+    "gender": {1: "Woman", 2: "Man", 3: "Other or prefer not to say"},
+    "recruitment": {1: "Social media", 2: "Email list", 3: "Other"},
+    "Dream_recall": RECALL,
+    "Nightmare_recall": RECALL,
+    "Lucid_recall": RECALL,
+    **{f"LUSK_{i}": AGREEMENT for i in range(1, 5)},
+}
+MORNING_LEVELS = {
+    "Task_completion": {1: "No", 2: "Partially", 3: "Yes"},
+    "Multiple_attempts": {1: "No", 2: "Yes"},
+    "Task_lucid": INTENSITY,
+    **{f"Dream_LUSK_{i}": AGREEMENT for i in range(1, 5)},
+    "Wakeup": {1: "Immediately", 2: "Within a minute", 3: "Within a few minutes", 4: "Later", 5: "Didn't wake up"},
+    "Wakeup_impact": {1: "Yes", 2: "No"},
+    "Lucidity": INTENSITY,
+    "Nightmare": INTENSITY,
+    "Sleep_paralysis": INTENSITY,
+    **{f"PANAS_{i}": INTENSITY for i in range(1, 21)},
+}
+
+# Participant IDs that source2raw.py fixes or removes, which can't be generated.
+RESERVED_IDS = [194811, 195811, 601519]
+
+
+def qualtrics_columns(start_dates, rng):
+    """Return the default Qualtrics columns for responses started at `start_dates` (naive, Qualtrics time)."""
+    n = len(start_dates)
+    durations = rng.integers(120, 1800, n)
+    end_dates = start_dates + pd.to_timedelta(durations, unit="s")
+    preview = rng.random(n) < 0.01
+    finished = rng.random(n) > 0.02
+    return pd.DataFrame({
+        "StartDate": start_dates,
+        "EndDate": end_dates,
+        "Status": preview.astype(float),
+        "Progress": np.where(finished, 100.0, rng.integers(5, 100, n)),
+        "Duration__in_seconds_": durations.astype(float),
+        "Finished": finished.astype(float),
+        "RecordedDate": end_dates,
+        "ResponseId": pd.Series(np.arange(n)).map("R_{:015d}".format).to_numpy(),
+        "DistributionChannel": np.where(preview, "preview", "anonymous"),
+        "UserLanguage": "EN",
+    })
+
+def random_levels(levels, n, rng):
+    """Return `n` random responses (as floats) from {column: levels}."""
+    return pd.DataFrame({col: rng.choice(list(col_levels), n).astype(float) for col, col_levels in levels.items()})
+
+def generate_sources(n_participants, collection_rounds, seed=0):
+    """Return synthetic initial and morning dataframes, with their value labels and probes.
+
+    `collection_rounds` are [start, end] timestamp strings as in the configuration file.
+    Participant IDs have 6 digits like the real ones, or 7 if there are more than 800,000 participants.
+    """
+    rng = np.random.default_rng(seed)
+    n = n_participants
+
+    # Start times spread over the collection rounds, in Qualtrics time (see utils.standard_qualtrics_clean).
+    edges = pd.to_datetime(utils.parse_collection_rounds(collection_rounds), utc=True)
+    edges = edges.tz_convert(utils.QUALTRICS_TIMEZONE).tz_localize(None).to_numpy().reshape(-1, 2)
+    round_index = rng.integers(0, len(edges), n)
+    round_starts = edges[round_index, 0]
+    round_lengths = (edges[round_index, 1] - round_starts) / np.timedelta64(1, "s")
+    # Whole seconds, the resolution of SPSS timestamps.
+    offsets = (rng.random(n) * (round_lengths - 1)).astype(np.int64)
+    start_dates = pd.DatetimeIndex(round_starts + offsets.astype("timedelta64[s]")).sort_values()
+
+    n_digits = 6 if n <= 800000 else 7
+    candidate_ids = np.setdiff1d(np.arange(10 ** (n_digits - 1), 10 ** n_digits), RESERVED_IDS)
+    participant_ids = rng.choice(candidate_ids, n, replace=False)
+
+    initial_df = qualtrics_columns(start_dates, rng)
+    initial_df["ParticipantID"] = participant_ids.astype(str)
+    initial_df = pd.concat([initial_df, random_levels(INITIAL_LEVELS, n, rng)], axis=1)
+    initial_df["Consent"] = np.where(rng.random(n) < 0.95, 1.0, 2.0)
+    for col in ["Email_other_1", "Email_other_2", "Email_other_4"]:
+        initial_df[col] = np.where(rng.random(n) < 0.4, 1.0, np.nan)
+    for i in range(1, 5):
+        initial_df.loc[rng.random(n) < 0.05, f"LUSK_{i}"] = np.nan
+    initial_df["Email"] = np.where(rng.random(n) < 0.7, "p" + initial_df["ParticipantID"] + "@example.com", "")
+    initial_df["TaskInstructions"] = rng.choice(["A", "B"], n)
+    initial_df["Condition"] = rng.choice(["Clench", "Visual", "Control"], n)
+
+    # About half of the eligible participants come back, a day or two later.
+    eligible = (
+        initial_df["Status"].eq(0) & initial_df["Finished"].eq(1) & initial_df["Progress"].eq(100)
+        & initial_df["Consent"].eq(1) & initial_df["age"].gt(1) & initial_df["Instructions"].isin([1, 2])
+    )
+    returning = np.flatnonzero(eligible.to_numpy() & (rng.random(n) < 0.5))
+    m = len(returning)
+    morning_starts = start_dates[returning] + pd.to_timedelta(rng.integers(12 * 3600, 48 * 3600, m), unit="s")
+    morning_df = qualtrics_columns(morning_starts.sort_values(), rng)
+    morning_df["ResponseId"] = "R_m" + morning_df["ResponseId"].str[3:]
+    morning_df["ParticipantID"] = initial_df["ParticipantID"].to_numpy()[returning][np.argsort(morning_starts)]
+    morning_df = pd.concat([morning_df, random_levels(MORNING_LEVELS, m, rng)], axis=1)
+    morning_df["Task_completion"] = rng.choice([1.0, 2.0, 3.0], m, p=[0.1, 0.1, 0.8])
+    # Only the scale items could be skipped.
+    for i in range(1, 21):
+        morning_df.loc[rng.random(m) < 0.03, f"PANAS_{i}"] = np.nan
+    morning_df["Dream_report"] = "Synthetic dream report."
+    morning_df["Free_response"] = ""
+
+    # Probes (question text) of all columns, item columns just get their name.
+    initial_probes = {col: col.replace("_", " ") for col in initial_df}
+    initial_probes.update({
+        col: f"Email me about - {INITIAL_LEVELS[col][1]}" for col in ["Email_other_1", "Email_other_2", "Email_other_4"]
+    })
+    morning_probes = {col: col.replace("_", " ") for col in morning_df}
+    initial_labels = {col: {float(k): v for k, v in levels.items()} for col, levels in INITIAL_LEVELS.items()}
+    morning_labels = {col: {float(k): v for k, v in levels.items()} for col, levels in MORNING_LEVELS.items()}
+    return (initial_df, initial_labels, initial_probes), (morning_df, morning_labels, morning_probes)
+
+def write_sources(root_dir, n_participants, collection_rounds, seed=0, export_time=None):
+    """Generate synthetic sources and write them to the sourcedata folder of `root_dir`, returning their paths.
+
+    Filenames end with the `export_time` (now by default) like those exported from Qualtrics.
+    """
+    source_dir = Path(root_dir) / "sourcedata"
+    source_dir.mkdir(parents=True, exist_ok=True)
+    export_time = (export_time or datetime.now()).strftime(utils.EXPORT_TIME_FORMAT)
+    names = [
+        f"Wakeup+Initial+questionnaire_{export_time}.sav",
+        f"Wakeup+Morning+report+form_{export_time}.sav",
+    ]
+    filepaths = []
+    for name, (df, labels, probes) in zip(names, generate_sources(n_participants, collection_rounds, seed)):
+        filepath = source_dir / name
+        pyreadstat.write_sav(df, filepath, column_labels=probes, variable_value_labels=labels)
+        filepaths.append(filepath)
+    return filepaths
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Generate synthetic Qualtrics exports.")
+    parser.add_argument("participants", type=int, help="Number of participants taking the initial survey.")
+    parser.add_argument("root", type=Path, help="Study root directory, sources are written to its sourcedata folder.")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed.")
+    args = parser.parse_args()
+
+    config = utils.load_config()
+    for filepath in write_sources(args.root, args.participants, config["collection_rounds"], seed=args.seed):
+        print(f"Wrote {filepath}")
@@ -1,89 +1,533 @@
-"""Helper functions."""
+"""Helper functions.
+
+Heavy dependencies (pandas, numpy, matplotlib, pyreadstat, scipy) are imported
+inside the functions that need them, so scripts only pay for what they use.
+"""
+import atexit
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+import glob
+import hashlib
 import json
+import multiprocessing
+import os
 from pathlib import Path
+import pickle
+import runpy
+import sys
+import threading
 import time
+import traceback
+import warnings
+
+import metadata
+import profiling
+
+# Columns stored as categoricals in the columnar raw data.
+CATEGORICAL_COLUMNS = ["Condition", "gender", "recruitment"]
+
+# Filename patterns of each qualtrics SPSS export, and the export time at the end of each filename.
+SOURCE_PATTERNS = {
+    "initial": "*Initial*questionnaire*.sav",
+    "morning": "*Morning*report*form*.sav",
+}
+EXPORT_TIME_FORMAT = "%B+%d,+%Y_%H.%M"
+# Timezone of Qualtrics timestamps, including the export times in filenames.
+QUALTRICS_TIMEZONE = "US/Mountain"
+# Shortest content hash prefix that can pin an export, see `select_qualtrics_export`.
+MIN_HASH_PREFIX = 7
+
+# Default Qualtrics columns, checked and then removed by `standard_qualtrics_clean`.
+QUALTRICS_COLUMNS = [
+    "StartDate", "EndDate", "RecordedDate",         # Qualtrics stuff we're done with.
+    "Status", "DistributionChannel", "Progress",    # Qualtrics stuff we're done with.
+    "Finished", "ResponseId", "UserLanguage",       # Qualtrics stuff we're done with.
+    "Duration__in_seconds_",
+]
+
+# Row filters, as (column, operator, value) predicates for `filter_rows` (and parquet readers).
+# Qualtrics responses from the anonymous link that were finished, see `standard_qualtrics_clean`.
+QUALTRICS_FILTERS = [
+    ("DistributionChannel", "==", "anonymous"),
+    ("Finished", "==", 1),
+    ("Progress", "==", 100),
+]
+# Participants who did the second part and completed its task, see `load_raw(trim=True)`.
+TRIM_FILTERS = [
+    ("Completed_part2", "==", True),
+    ("Task_completion", "==", 3),
+]
+
+# Columns retained by `load_raw(trim=True)`.
+KEEP_COLUMNS = [
+    "ParticipantID",
+    "Condition",
+    "age",
+    "gender",
+    "recruitment",
+    "Dream_recall",
+    "Nightmare_recall",
+    "Lucid_recall",
+    "LUSK",  # derived
+    "Multiple_attempts",
+    "Task_lucid",
+    "Dream_LUSK",  # derived
+    "Wakeup",
+    "Wakeup_impact",
+    "Lucidity",
+    "Nightmare",
+    "Sleep_paralysis",
+    "PANAS_pos",  # derived
+    "PANAS_neg",  # derived
+    "Dream_report",
+    "Free_response",
+]
+
+
+# Operators available to `filter_rows`, each returning a boolean mask with missing values as False.
+PREDICATE_OPERATORS = {
+    "==": lambda ser, value: ser.eq(value).fillna(False),
+    "!=": lambda ser, value: ser.ne(value) & ser.notna(),
+    "<": lambda ser, value: ser.lt(value).fillna(False),
+    "<=": lambda ser, value: ser.le(value).fillna(False),
+    ">": lambda ser, value: ser.gt(value).fillna(False),
+    ">=": lambda ser, value: ser.ge(value).fillna(False),
+    "in": lambda ser, value: ser.isin(value),
+    "not in": lambda ser, value: ~ser.isin(value) & ser.notna(),
+    "in rounds": lambda ser, value: in_collection_rounds(ser, value),
+}
+
+# Environment variable choosing the study profile of the configuration file (see `load_config`).
+STUDY_VARIABLE = "WAKEUP_STUDY"
+
+# Session whose loaded data is shared by scripts, set while `Session.run` runs a script.
+_active_session = None
 
-import matplotlib.pyplot as plt
-import numpy as np
-import pandas as pd
-import pyreadstat
 
+def load_config(study=None):
+    """Return the configuration file, with the settings of one study.
 
-def load_config():
-    """Return the configuration file."""
+    Study-specific settings (e.g., root directory, collection rounds, participant ID fixes)
+    are in the named profiles under "studies", and override the general settings.
+    The study is `study` if given, otherwise the one named in the WAKEUP_STUDY environment
+    variable (set by runall.py for each study), otherwise "default_study".
+    """
+    if _active_session is not None and study is None:
+        return _active_session.config()
+    with open("./config.json", "r", encoding="utf-8") as jsonfile:
+        return resolve_study(json.load(jsonfile), study)
+
+def resolve_study(config, study=None):
+    """Return `config` with the settings of a study profile (see `load_config`) at the top level.
+
+    The name of the study is added as "study". Configurations without profiles are returned as they are.
+    """
+    studies = config.pop("studies", None)
+    if not studies:
+        return config
+    if study is None:
+        study = os.environ.get(STUDY_VARIABLE) or config.get("default_study")
+    assert study in studies, f"Study {study} must be one of {list(studies)}."
+    return {**config, **studies[study], "study": study}
+
+def list_studies():
+    """Return the names of all study profiles in the configuration file."""
     with open("./config.json", "r", encoding="utf-8") as jsonfile:
-        return json.load(jsonfile)
+        return list(json.load(jsonfile).get("studies", {}))
 
-def load_raw(trim=False):
-    """Load raw data tsv and sidecar json files.
+@profiling.profiled
+def load_raw(trim=False, study=None):
+    """Load raw data and sidecar json files (the latter as a `metadata.Sidecar`).
 
+    Reads the typed parquet copy of the data if present, otherwise the tsv.
     If `trim` is True, reduce to only participants who completed part 2 and remove excess columns.
+    The data are from `study`, by default the current one (see `load_config`).
+    Within a `Session`, the data are only loaded once and each call gets its own copy.
     """
-    config = load_config()
+    import pandas as pd
+
+    if _active_session is not None and study is None:
+        return _active_session.raw(trim=trim)
+    config = load_config(study)
     root_dir = Path(config["root_directory"])
     import_path_data = root_dir / "derivatives" / "data.tsv"
+    import_path_columnar = import_path_data.with_suffix(".parquet")
     import_path_sidecar = import_path_data.with_suffix(".json")
 
-    df = pd.read_csv(import_path_data, sep="\t")
+    if import_path_columnar.exists():
+        df = load_columnar_raw(import_path_columnar, trim=trim)
+    else:
+        df = pd.read_csv(import_path_data, sep="\t")
     with open(import_path_sidecar, "r", encoding="utf-8") as fp:
-        sidecar = json.load(fp)
+        sidecar = metadata.Sidecar(json.load(fp))
 
     if trim:
         # Reduce to only those who participated in the second part and completed the second part task.
-        df = df.query("Completed_part2.eq(True)").query("Task_completion.eq(3)")
+        df, _ = filter_rows(df, TRIM_FILTERS)
         # Reduce to desired columns.
-        KEEP_COLUMNS = [
-            "ParticipantID",
-            "Condition",
-            "age",
-            "gender",
-            "recruitment",
-            "Dream_recall",
-            "Nightmare_recall",
-            "Lucid_recall",
-            "LUSK",  # derived
-            "Multiple_attempts",
-            "Task_lucid",
-            "Dream_LUSK",  # derived
-            "Wakeup",
-            "Wakeup_impact",
-            "Lucidity",
-            "Nightmare",
-            "Sleep_paralysis",
-            "PANAS_pos",  # derived
-            "PANAS_neg",  # derived
-            "Dream_report",
-            "Free_response",
-        ]
         df = df[KEEP_COLUMNS]
-        sidecar = {k: v for k, v in sidecar.items() if k in df or k == "MeasurementToolMetadata"}
+        sidecar = metadata.Sidecar({k: v for k, v in sidecar.items() if k in df or k == sidecar.DESCRIPTION_KEY})
     return df, sidecar
 
-def load_qualtrics_source(which):
-    """Return raw qualtrics SPSS data."""
-    assert which in ["initial", "morning"]
+@profiling.profiled
+def save_raw(df, sidecar, export_path_data):
+    """Export raw data to a tsv, a typed columnar copy (parquet, same name) and the sidecar (json, same name).
 
-    root_dir = Path(load_config()["root_directory"])
+    `df` has participants as its index, and compact types (see `compact_dtypes`).
+    """
+    export_path_data = Path(export_path_data)
+    # Likert columns are written like all other numbers in the tsv.
+    tsv_df = df.astype({col: float for col in sidecar.likert_columns})
+    tsv_df.to_csv(export_path_data, index=True, na_rep="n/a", float_format="%.3f", sep="\t")
+    # Also export the typed columnar copy at full precision, which `load_raw` prefers.
+    df.reset_index().to_parquet(export_path_data.with_suffix(".parquet"), index=False)
+    with open(export_path_data.with_suffix(".json"), "w", encoding="utf-8") as fp:
+        json.dump(sidecar, fp, indent=4, sort_keys=False, ensure_ascii=True)
+
+def load_columnar_raw(filepath, trim=False):
+    """Load the parquet copy of the raw data.
+
+    If `trim` is True, only the columns needed for trimming and `KEEP_COLUMNS` are read
+    and the participant filtering is pushed down to the parquet reader.
+    Nullable integer (Likert) columns are returned as floats so missing values are NaN,
+    same as when loading from the tsv.
+    """
+    import pandas as pd
+
+    if trim:
+        columns = ["Completed_part2", "Task_completion"] + KEEP_COLUMNS
+        df = pd.read_parquet(filepath, columns=columns, filters=TRIM_FILTERS)
+    else:
+        df = pd.read_parquet(filepath)
+    integer_columns = [
+        c for c in df
+        if isinstance(df[c].dtype, pd.api.extensions.ExtensionDtype) and pd.api.types.is_integer_dtype(df[c].dtype)
+    ]
+    df[integer_columns] = df[integer_columns].astype(float)
+    return df
+
+class Session:
+    """Run multiple scripts in one interpreter, loading the config and raw data only once.
+
+    While a script runs through `Session.run`, `load_config` and `load_raw` return copies
+    of what this session already loaded. Loaded files are reloaded if they change on disk
+    (e.g., after source2raw.py runs), so a session can be kept around between runs.
+
+        session = utils.Session()
+        for script in ["demographics.py", "wakeup_impact.py"]:
+            session.run(script)
+    """
+    def __init__(self):
+        self._config = None
+        self._config_stamp = None
+        self._raw = {}
+
+    @staticmethod
+    def _stamp(paths):
+        """Return modification times and sizes of `paths`, to tell when they change."""
+        return tuple((p.stat().st_mtime_ns, p.stat().st_size) if p.exists() else None for p in map(Path, paths))
+
+    def config(self):
+        """Return a copy of the configuration file, with the settings of the current study."""
+        stamp = self._stamp(["./config.json"])
+        if stamp != self._config_stamp:
+            with open("./config.json", "r", encoding="utf-8") as jsonfile:
+                self._config = json.load(jsonfile)
+            self._config_stamp = stamp
+        return resolve_study(json.loads(json.dumps(self._config)))
+
+    def raw(self, trim=False):
+        """Return copies of the raw data and sidecar, loading them if not already loaded."""
+        import_path_data = Path(self.config()["root_directory"]) / "derivatives" / "data.tsv"
+        stamp = self._stamp([import_path_data.with_suffix(ext) for ext in [".tsv", ".parquet", ".json"]])
+        # Each study has its own data.
+        key = (str(import_path_data.resolve()), trim)
+        if self._raw.get(key, (None,))[0] != stamp:
+            global _active_session
+            session, _active_session = _active_session, None
+            try:
+                df, sidecar = load_raw(trim=trim)
+            finally:
+                _active_session = session
+            self._raw[key] = (stamp, df, sidecar)
+        _, df, sidecar = self._raw[key]
+        return df.copy(), metadata.Sidecar(json.loads(json.dumps(sidecar)))
+
+    def run(self, script, args=(), study=None):
+        """Run `script` as if it were the main program, returning 0 on success and 1 on error.
+
+        The script gets `args` as its command line arguments, and the settings of `study` (if given)
+        from `load_config`. Scripts draw figures within `figure_style`, which scopes their matplotlib
+        settings. If profiling, the script gets its own entry in profile.json.
+        """
+        global _active_session
+        _active_session = self
+        argv, previous_study = sys.argv, os.environ.get(STUDY_VARIABLE)
+        sys.argv = [script, *args]
+        if study is not None:
+            os.environ[STUDY_VARIABLE] = study
+        previous_profiler = profiling.start(script)
+        try:
+            runpy.run_path(script, run_name="__main__")
+            return 0
+        except SystemExit as error:
+            return 0 if error.code in (None, 0) else 1
+        except Exception:
+            traceback.print_exc()
+            return 1
+        finally:
+            if profiling.enabled():
+                profiling.stop(Path(self.config()["root_directory"]) / "derivatives", previous_profiler)
+            _active_session = None
+            sys.argv = argv
+            if previous_study is None:
+                os.environ.pop(STUDY_VARIABLE, None)
+            else:
+                os.environ[STUDY_VARIABLE] = previous_study
+
+def _stop_profiling():
+    """Stop profiling the main script, adding it to profile.json in derivatives (see profiling.py)."""
+    profiling.stop(Path(load_config()["root_directory"]) / "derivatives")
+
+def update_source_manifest(study=None):
+    """Return the manifest of qualtrics exports in sourcedata (of `study`, see `load_config`), updating it first if needed.
+
+    The manifest (derivatives/source_manifest.json) maps each export filename to its
+    survey, export time (parsed from the filename), size, modification time, content hash
+    and number of rows. Only files that are new or changed since the last update get
+    parsed and hashed. Files without an export time in their name are skipped with a warning.
+    """
+    import pyreadstat
+
+    root_dir = Path(load_config(study)["root_directory"])
     source_dir = root_dir / "sourcedata"
-    if which == "initial":
-        potential_paths = list(source_dir.glob("*Initial*questionnaire*.sav"))
-    elif which == "morning":
-        potential_paths = list(source_dir.glob("*Morning*report*form*.sav"))
-    
-    # Find most recent filename.
-    date_strings = [ x.stem.split("_", 1)[1] for x in potential_paths ]
-    date_times = [ time.strptime(x, "%B+%d,+%Y_%H.%M") for x in date_strings ]
-    recent_date = max(date_times)
-    recent_index = date_times.index(recent_date)
-    
-    filepath = potential_paths[recent_index]
-
-    df, meta = pyreadstat.read_sav(filepath)
+    manifest_path = root_dir / "derivatives" / "source_manifest.json"
+
+    manifest = {}
+    if manifest_path.exists():
+        with open(manifest_path, "r", encoding="utf-8") as fp:
+            manifest = json.load(fp)
+
+    updated_manifest = {}
+    for which, pattern in SOURCE_PATTERNS.items():
+        for filepath in sorted(source_dir.glob(pattern)):
+            stat = filepath.stat()
+            entry = manifest.get(filepath.name)
+            if entry is not None and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime_ns:
+                updated_manifest[filepath.name] = entry
+                continue
+            try:
+                export_time = datetime.strptime(filepath.stem.split("_", 1)[1], EXPORT_TIME_FORMAT)
+            except (IndexError, ValueError):
+                warnings.warn(f"Skipping {filepath.name}, its name doesn't end with an export time like "
+                    "_February+4,+2022_15.24 (the Qualtrics default).")
+                continue
+            _, meta = pyreadstat.read_sav(filepath, metadataonly=True)
+            updated_manifest[filepath.name] = {
+                "filename": filepath.name,
+                "which": which,
+                "export_time": export_time.isoformat(),
+                "size": stat.st_size,
+                "mtime": stat.st_mtime_ns,
+                "sha256": file_hash(filepath),
+                "n_rows": meta.number_rows,
+            }
+
+    if updated_manifest != manifest:
+        # Write to a temporary file first so other scripts never read a partial manifest.
+        manifest_path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = manifest_path.with_suffix(f".{os.getpid()}.tmp")
+        with open(temp_path, "w", encoding="utf-8") as fp:
+            json.dump(updated_manifest, fp, indent=4)
+        os.replace(temp_path, manifest_path)
+
+    return updated_manifest
+
+def select_qualtrics_export(which, version=None, study=None):
+    """Return the manifest entry of a qualtrics SPSS export.
+
+    `version` can be "latest", a filename or content hash (prefix of at least `MIN_HASH_PREFIX`
+    characters) to pin a specific export, or a timestamp to get the most recent export as of then.
+    Timestamps without a UTC offset are taken as Qualtrics time (`QUALTRICS_TIMEZONE`).
+    If None, the version is taken from the "source_versions" configuration option, defaulting to "latest".
+    The exports and configuration are those of `study` (see `load_config`).
+    """
+    import pandas as pd
+
+    assert which in SOURCE_PATTERNS, f"which must be one of {list(SOURCE_PATTERNS)}."
+    if version is None:
+        version = load_config(study).get("source_versions", {}).get(which, "latest")
+
+    entries = [e for e in update_source_manifest(study).values() if e["which"] == which]
+    entries = sorted(entries, key=lambda e: e["export_time"])
+    assert entries, f"No {which} exports found in sourcedata."
+
+    if version == "latest":
+        return entries[-1]
+    for entry in entries:
+        if version == entry["filename"]:
+            return entry
+        if len(version) >= MIN_HASH_PREFIX and entry["sha256"].startswith(version):
+            return entry
+    try:
+        as_of = pd.Timestamp(version)
+    except ValueError:
+        as_of = pd.NaT
+    assert not pd.isna(as_of), (f"Version {version!r} of {which} must be \"latest\", a filename, "
+        f"a content hash prefix of at least {MIN_HASH_PREFIX} characters, or a timestamp.")
+    if as_of.tz is None:
+        as_of = as_of.tz_localize(QUALTRICS_TIMEZONE)
+    # Export times are in Qualtrics time.
+    earlier_entries = [
+        e for e in entries if pd.Timestamp(e["export_time"]).tz_localize(QUALTRICS_TIMEZONE) <= as_of
+    ]
+    assert earlier_entries, f"No {which} exports as of {version}."
+    return earlier_entries[-1]
+
+def find_qualtrics_source(which, version=None):
+    """Return the filepath of a qualtrics SPSS export (the most recent by default, see `select_qualtrics_export`)."""
+    root_dir = Path(load_config()["root_directory"])
+    return root_dir / "sourcedata" / select_qualtrics_export(which, version)["filename"]
+
+@profiling.profiled
+def load_qualtrics_source(which, use_cache=True, version=None, n_jobs=1):
+    """Return raw qualtrics SPSS data.
+
+    `version` picks which export to load (the most recent by default, see `select_qualtrics_export`).
+    If `use_cache` is True, a parsed copy of the SPSS file is kept in derivatives/cache
+    and reused until the source file changes. With `n_jobs` > 1, parsing is split by row ranges
+    across that many processes.
+    """
+    root_dir = Path(load_config()["root_directory"])
+    entry = select_qualtrics_export(which, version)
+    filepath = root_dir / "sourcedata" / entry["filename"]
+
+    if use_cache:
+        cache_dir = root_dir / "derivatives" / "cache"
+        df, meta = read_sav_cached(filepath, cache_dir, digest=entry["sha256"], n_jobs=n_jobs)
+    else:
+        df, meta = read_sav(filepath, n_jobs=n_jobs)
+
+    return df, meta
+
+def _load_clean_qualtrics_source(task):
+    """Load and clean one qualtrics source, for `load_clean_qualtrics_sources`."""
+    which, keep_columns, n_jobs = task
+    df, meta = load_qualtrics_source(which, n_jobs=n_jobs)
+    df, exclusions = standard_qualtrics_clean(df, keep_columns=keep_columns, return_exclusions=True)
+    return df, meta, exclusions
+
+@profiling.profiled
+def load_clean_qualtrics_sources(sources, keep_columns=[], n_jobs=1):
+    """Return {source: (data, metadata, exclusions)} of qualtrics `sources` (e.g., ["initial", "morning"]).
+
+    Each source is loaded (see `load_qualtrics_source`) and cleaned (see `standard_qualtrics_clean`).
+    With `n_jobs` > 1, the sources are handled in parallel processes, and each source splits
+    its share of the `n_jobs` across row ranges of its file.
+    """
+    tasks = [(which, keep_columns, max(1, n_jobs // len(sources))) for which in sources]
+    if n_jobs == 1 or len(sources) == 1:
+        results = list(map(_load_clean_qualtrics_source, tasks))
+    else:
+        with ProcessPoolExecutor(max_workers=min(n_jobs, len(sources))) as executor:
+            results = list(executor.map(_load_clean_qualtrics_source, tasks))
+    return dict(zip(sources, results))
+
+@profiling.profiled
+def stream_qualtrics_source(which, usecols=None, chunksize=10000, clean=True, keep_columns=[], version=None):
+    """Return qualtrics SPSS data read in chunks, keeping only `usecols` (all if None).
+
+    Peak memory is one chunk of the requested columns rather than the full file.
+    If `clean` is True, each chunk goes through `standard_qualtrics_clean` (with `keep_columns`)
+    before the surviving rows are combined. The Qualtrics columns needed for cleaning
+    are read even if not in `usecols`, and dropped after unless in `keep_columns`.
+    """
+    import pandas as pd
+    import pyreadstat
+
+    filepath = find_qualtrics_source(which, version)
+
+    if clean and usecols is not None:
+        usecols = list(dict.fromkeys(QUALTRICS_COLUMNS + list(usecols)))
+    # Sorting and checking for unique responses has to wait until all chunks are combined.
+    chunk_keep_columns = list(dict.fromkeys(list(keep_columns) + ["StartDate", "ResponseId"]))
+
+    chunks = []
+    offset = 0
+    for chunk, meta in pyreadstat.read_file_in_chunks(
+            pyreadstat.read_sav, filepath, chunksize=chunksize, usecols=usecols):
+        # Number rows by their position in the file, same as a full read.
+        chunk.index = chunk.index + offset
+        offset += len(chunk)
+        if clean:
+            chunk = standard_qualtrics_clean(chunk, keep_columns=chunk_keep_columns)
+        chunks.append(chunk)
+    df = pd.concat(chunks)
+
+    if clean:
+        df = df.sort_values("StartDate", kind="stable")
+        assert df["ResponseId"].is_unique, "These should all be unique."
+        df = df.drop(columns=[c for c in ["StartDate", "ResponseId"] if c not in keep_columns])
+
+    return df, meta
+
+def file_hash(filepath, chunksize=2**20):
+    """Return the sha256 hex digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as fp:
+        for chunk in iter(lambda: fp.read(chunksize), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+@profiling.profiled
+def read_sav(filepath, n_jobs=1):
+    """Read an SPSS file, split by row ranges across `n_jobs` processes if more than 1."""
+    import pyreadstat
+
+    if n_jobs > 1:
+        return pyreadstat.read_file_multiprocessing(pyreadstat.read_sav, filepath, num_processes=n_jobs)
+    return pyreadstat.read_sav(filepath)
+
+def read_sav_cached(filepath, cache_dir, digest=None, n_jobs=1):
+    """Read an SPSS file, reusing a parsed copy from `cache_dir` if the file is unchanged.
+
+    The dataframe is cached as parquet and the pyreadstat metadata is pickled,
+    both keyed on a hash of the SPSS file contents. Older cached versions of
+    the same file are removed whenever the cache is rebuilt.
+    Pass the file's sha256 `digest` if already known to skip hashing it again.
+    Parsing uses `n_jobs` processes (see `read_sav`).
+    """
+    import pandas as pd
+
+    filepath = Path(filepath)
+    cache_dir = Path(cache_dir)
+    if digest is None:
+        digest = file_hash(filepath)
+    digest = digest[:16]
+    cache_path_data = cache_dir / f"{filepath.stem}-{digest}.parquet"
+    cache_path_meta = cache_path_data.with_suffix(".pkl")
+
+    if cache_path_data.exists() and cache_path_meta.exists():
+        df = pd.read_parquet(cache_path_data)
+        with open(cache_path_meta, "rb") as fp:
+            meta = pickle.load(fp)
+        return df, meta
+
+    df, meta = read_sav(filepath, n_jobs=n_jobs)
+
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    for stale_path in cache_dir.glob(f"{glob.escape(filepath.stem)}-*"):
+        stale_path.unlink()
+    df.to_parquet(cache_path_data, index=False)
+    with open(cache_path_meta, "wb") as fp:
+        pickle.dump(meta, fp)
 
     return df, meta
 
 
-def standard_qualtrics_clean(df, keep_columns=[]):
+@profiling.profiled
+def standard_qualtrics_clean(df, keep_columns=[], return_exclusions=False):
     """The qualtrics file comes baked with some columns we don't need.
     Make sure they are all "in order" or as expected,
     and then take them off the dataframe.
@@ -91,15 +535,15 @@ def standard_qualtrics_clean(df, keep_columns=[]):
 
     Removes non-anonymous links (pilot participants)
     and those who didn't finish (actually not sure about the latter).
+    If `return_exclusions` is True, also return the number of rows removed by each filter.
     """
 
     # Exclude any submissions prior to the original study advertisement.
     # Convert to the Qualtrics timestamps from MST to CST since that's the time I have it in.
-    for col in ["StartDate", "EndDate", "RecordedDate"]:
-        df[col] = df[col].dt.tz_localize("US/Mountain").dt.tz_convert("US/Central")
+    df = convert_timezone(df, ["StartDate", "EndDate", "RecordedDate"], QUALTRICS_TIMEZONE, "US/Central")
 
     # Sort for readability
-    df = df.sort_values("StartDate")
+    df = df.sort_values("StartDate", kind="stable")
 
     ################################# Handle Qualtrics-specific columns.
     ## These have nothing to do with out data.
@@ -107,13 +551,11 @@ def standard_qualtrics_clean(df, keep_columns=[]):
     ## Then remove them for cleanliness.
 
     ##### Remove piloting/testing data.
-    # That should handle all the "previews" from this column, but check.
-    df = df.query("DistributionChannel=='anonymous'")
+    # DistributionChannel=='anonymous' should handle all the "previews" from this column, but check.
     # assert df["DistributionChannel"].eq("anonymous").all(), "All surveys should have come from the anonymous link."
     # This is also redundnat but make sure "IP Address" is here (just indicates normal response, IP was not collected).
     # df = df.query("Status=='IP Address'")
     # assert df["Status"].eq("IP Address").all(), "All surveys should have come from the anonymous link."
-    assert df["Status"].eq(0).all(), "All surveys should have come from the anonymous link."
 
     ##### Remove unfinished surveys.
     ##### (This only catches those that left early,
@@ -127,8 +569,11 @@ def standard_qualtrics_clean(df, keep_columns=[]):
     # Still make sure Finished and Progress are both full (as I'm expecting)
     # I think there's a way to export with incomplete I probably didn't check that.
     # Or they might be "in progress"?
-    df = df.query("Finished==1")
-    df = df.query("Progress==100") # redundant I think
+    # Progress==100 is redundant I think.
+    # All of these filters (see QUALTRICS_FILTERS) are applied at once.
+    df, exclusions = filter_rows(df, QUALTRICS_FILTERS)
+
+    assert df["Status"].eq(0).all(), "All surveys should have come from the anonymous link."
 
     # Can't see how these would be off but w/e just check
     assert df["ResponseId"].is_unique, "These should all be unique."
@@ -143,36 +588,358 @@ def standard_qualtrics_clean(df, keep_columns=[]):
     ## Then remove them for cleanliness.
 
     # Remove default Qualtrics columns
-    drop_columns = [
-        "StartDate", "EndDate", "RecordedDate",         # Qualtrics stuff we're done with.
-        "Status", "DistributionChannel", "Progress",    # Qualtrics stuff we're done with.
-        "Finished", "ResponseId", "UserLanguage",       # Qualtrics stuff we're done with.
-        "Duration__in_seconds_",
-    ]
+    drop_columns = list(QUALTRICS_COLUMNS)
     for c in keep_columns:
         drop_columns.remove(c)
 
     df = df.drop(columns=drop_columns)
+    if return_exclusions:
+        return df, exclusions
     return df
 
+@profiling.profiled
+def filter_rows(df, predicates):
+    """Return the rows of `df` meeting all `predicates`, and the number of rows each predicate removed.
+
+    Each predicate is a (column, operator, value) tuple, with operators "==", "!=", "<", "<=", ">", ">=",
+    "in", "not in", and "in rounds" (value from `parse_collection_rounds`). All predicates are combined
+    into one mask so only one filtered copy is made. Removed counts are sequential, i.e., rows
+    that passed all previous predicates but not this one. Missing values never pass.
+    """
+    import numpy as np
+
+    keep = np.ones(len(df), dtype=bool)
+    n_removed = {}
+    for column, op, value in predicates:
+        passes = np.asarray(PREDICATE_OPERATORS[op](df[column], value), dtype=bool)
+        # Collection round edges are too long to be readable.
+        label = f"{column} {op}" if op == "in rounds" else f"{column} {op} {value}"
+        n_removed[label] = int(np.sum(keep & ~passes))
+        keep &= passes
+    return df[keep], n_removed
 
-def validate_likert_scales(meta, vars_to_validate):
-    """Sometimes when the Qualtrics question is edited
-    the scale gets changed "unknowingly". Here, check
-    to make sure everything starts at 1 and increases by 1.
-    Could be remapped but it's easier and safer to fix
-    the source of the problem in Qualtrics.
-    """
-    if isinstance(vars_to_validate, str):
-        vars_to_validate = [vars_to_validate]
-    assert isinstance(vars_to_validate, list)
-    for var in vars_to_validate:
-        if var in meta.variable_value_labels:
-            levels = meta.variable_value_labels[var]
-            values = list(levels.keys())
-            assert values[0] == 1, f"{var} scale doesn't start at 1. Recode values in Qualtrics and re-export."
-            assert values == sorted(values), f"{var} scale is not in increasing order. Recode values in Qualtrics and re-export."
-            assert not np.any(np.diff(values) != 1), f"{var} scale is not linear. Recode values in Qualtrics and re-export."
+
+def convert_timezone(df, columns, from_tz, to_tz):
+    """Return `df` with naive timestamp `columns` localized to `from_tz` and converted to `to_tz`.
+
+    All columns are converted together as one flattened array.
+    """
+    import pandas as pd
+
+    values = df[columns].to_numpy().ravel(order="F")
+    converted = pd.DatetimeIndex(values).tz_localize(from_tz).tz_convert(to_tz)
+    n_rows = len(df)
+    return df.assign(**{col: converted[i * n_rows:(i + 1) * n_rows].array for i, col in enumerate(columns)})
+
+def parse_collection_rounds(rounds):
+    """Return data collection rounds as sorted window edges for `in_collection_rounds`.
+
+    `rounds` is a list of [start, end] timestamp strings, which need a UTC offset
+    (e.g., "2022-02-04 15:24:32-06:00"). Overlapping rounds are merged. Edges are
+    epoch nanoseconds, alternating start and (exclusive) end, so parse once and reuse.
+    """
+    import numpy as np
+    import pandas as pd
+
+    windows = []
+    for start, end in rounds:
+        start, end = pd.Timestamp(start), pd.Timestamp(end)
+        assert start.tz is not None and end.tz is not None, f"Round {start} to {end} needs a UTC offset."
+        assert start <= end, f"Round starting {start} ends before it starts."
+        windows.append([start.value, end.value + 1])  # +1ns so the end is inclusive
+    windows.sort()
+    merged = []
+    for start, end in windows:
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return np.array(merged, dtype=np.int64).ravel()
+
+def in_collection_rounds(timestamps, round_edges):
+    """Return a boolean array, True where timezone-aware `timestamps` fall within any round (inclusive).
+
+    `round_edges` come from `parse_collection_rounds`. Each timestamp is located
+    among the edges with one binary search, and falls in a round if after an odd number of edges.
+    Missing timestamps are never in a round.
+    """
+    import numpy as np
+    import pandas as pd
+
+    timestamps = pd.DatetimeIndex(timestamps)
+    assert timestamps.tz is not None, "Timestamps need a timezone to compare against collection rounds."
+    epochs = timestamps.as_unit("ns").asi8
+    in_round = np.searchsorted(round_edges, epochs, side="right") % 2 == 1
+    return in_round & ~timestamps.isna()
+
+@profiling.profiled
+def remap_codes(df, remappings):
+    """Return `df` with integer codes recoded, as {column: {old code: new code}} in `remappings`.
+
+    All columns are recoded at once through one lookup table per column (row = column, position = code).
+    Codes not in a column's remapping (and missing values) are left as they are.
+    """
+    import numpy as np
+
+    columns = list(remappings)
+    if not columns:
+        return df
+    old_codes = [code for remap in remappings.values() for code in remap]
+    low, high = min(old_codes), max(old_codes)
+    # Identity tables, with the remapped codes swapped in.
+    table = np.tile(np.arange(low, high + 1, dtype=float), (len(columns), 1))
+    for i, remap in enumerate(remappings.values()):
+        table[i, np.array(list(remap)) - low] = list(remap.values())
+
+    values = df[columns].to_numpy(dtype=float, copy=True)
+    in_table = (values >= low) & (values <= high) & (values == np.round(values))
+    rows, cols = np.nonzero(in_table)
+    positions = cols * table.shape[1] + (values[rows, cols] - low).astype(int)
+    values[rows, cols] = np.take(table, positions)
+    return df.assign(**dict(zip(columns, values.T)))
+
+@profiling.profiled
+def compact_dtypes(df, sidecar):
+    """Return `df` with compact column types, for a smaller in-memory and columnar footprint.
+
+    Likert columns (those with "Levels" in the `sidecar`) become the smallest nullable integer type
+    fitting their values, and `CATEGORICAL_COLUMNS` become categoricals (of those integers if Likert).
+    Likert columns with non-integer values (e.g., partially labeled sliders) are left as they are.
+    """
+    import numpy as np
+    import pandas as pd
+
+    dtypes = {}
+    for col, column_info in sidecar.items():
+        if col not in df or "Levels" not in column_info:
+            continue
+        ser = df[col]
+        if isinstance(ser.dtype, pd.CategoricalDtype):
+            ser = ser.astype(ser.cat.categories.dtype)
+        if not pd.api.types.is_numeric_dtype(ser):
+            continue
+        values = ser.dropna().to_numpy(dtype=float)
+        if not np.isfinite(values).all() or (values != np.round(values)).any():
+            continue
+        low, high = (values.min(), values.max()) if values.size else (0, 0)
+        dtypes[col] = next(
+            dtype for dtype in ["Int8", "Int16", "Int32", "Int64"]
+            if np.iinfo(dtype.lower()).min <= low and high <= np.iinfo(dtype.lower()).max
+        )
+    df = df.astype(dtypes)
+    return df.astype({col: "category" for col in CATEGORICAL_COLUMNS if col in df})
+
+@profiling.profiled
+def score_scales(df, scales, cutoff=0.5):
+    """Return a dataframe of aggregated questionnaire scores, one column per scale.
+
+    `scales` maps each scale name to a dict with keys
+        items: list of item columns in `df`
+        method: "sum" or "mean"
+        reverse: (optional) list of items to reverse-score
+        levels: (optional) lowest and highest response values, needed for `reverse`
+
+    All scales are scored at once from a single item matrix. Participants missing
+    more than `cutoff` proportion of a scale's items get NaN, otherwise missing items
+    are imputed with that participant's mean of the remaining items.
+    """
+    import numpy as np
+    import pandas as pd
+
+    item_columns = []
+    reverse_mask = []
+    reverse_offsets = []
+    starts = []
+    for name, scale in scales.items():
+        assert scale["method"] in ["sum", "mean"], f"{name} method must be sum or mean."
+        assert scale["items"], f"{name} has no items."
+        reverse = scale.get("reverse", [])
+        if reverse:
+            assert "levels" in scale, f"{name} needs levels to reverse-score items."
+        starts.append(len(item_columns))
+        for item in scale["items"]:
+            item_columns.append(item)
+            reverse_mask.append(item in reverse)
+            reverse_offsets.append(sum(scale["levels"]) if item in reverse else 0)
+    reverse_mask = np.array(reverse_mask)
+    reverse_offsets = np.array(reverse_offsets, dtype=float)
+
+    values = df[item_columns].to_numpy(dtype=float, copy=True)
+    values[:, reverse_mask] = reverse_offsets[reverse_mask] - values[:, reverse_mask]
+    missing = np.isnan(values)
+    n_items = np.diff(starts + [len(item_columns)])
+    n_missing = np.add.reduceat(missing, starts, axis=1)
+    sums = np.add.reduceat(np.where(missing, 0, values), starts, axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        means = sums / (n_items - n_missing)
+    # Filling missing items with the row mean leaves the mean unchanged and scales the sum.
+    is_sum = np.array([scale["method"] == "sum" for scale in scales.values()])
+    scores = np.where(is_sum, means * n_items, means)
+    scores[n_missing / n_items > cutoff] = np.nan
+    return pd.DataFrame(scores, index=df.index, columns=list(scales))
+
+@profiling.profiled
+def frequency_table(df, variables, by, labels={}):
+    """Return counts of each response to `variables`, within each group of the `by` column.
+
+    Rows are (variable, response) for every response given at least once, sorted,
+    and columns are the groups (sorted) plus a "total" column. Responses of a variable in `labels`
+    ({variable: {code: label}}) are replaced by their label, and left out if they don't have one.
+    Missing responses aren't counted. Each variable is counted with one bincount over integer codes,
+    so memory doesn't grow with the number of variables.
+    """
+    import numpy as np
+    import pandas as pd
+
+    group_codes, groups = pd.factorize(df[by], sort=True)
+    n_groups = len(groups)
+    tables = []
+    for var in variables:
+        codes, responses = pd.factorize(df[var], sort=True)
+        counted = (codes >= 0) & (group_codes >= 0)
+        counts = np.bincount(
+            codes[counted] * n_groups + group_codes[counted], minlength=len(responses) * n_groups
+        ).reshape(len(responses), n_groups)
+        responses = pd.Series(responses)
+        if var in labels:
+            responses = responses.map(labels[var])
+        labeled = responses.notna().to_numpy()
+        index = pd.MultiIndex.from_product([[var], responses[labeled]], names=["variable", "response"])
+        tables.append(pd.DataFrame(counts[labeled], index=index, columns=list(groups)))
+    freqs = pd.concat(tables).sort_index()
+    return freqs.assign(total=freqs.sum(axis=1))
+
+@profiling.profiled
+def pairwise_histograms(df, bins, chunksize=10000):
+    """Return histogram counts of every column and every pair of columns in `bins` ({column: bin edges}).
+
+    Returns {column: 1D counts} and {(xcolumn, ycolumn): 2D counts, x along the first axis} for each
+    pair with xcolumn before ycolumn in `bins`. Each column is binned once and all pairs are counted
+    with one bincount per chunk of `chunksize` rows. Values outside the bins or missing are left out.
+    """
+    import numpy as np
+
+    columns = list(bins)
+    n_bins = np.array([len(bins[col]) - 1 for col in columns])
+    # Bin index of every value, -1 if outside the bins (right edge included like np.histogram).
+    codes = np.empty((len(df), len(columns)), dtype=np.int64)
+    for i, col in enumerate(columns):
+        values = df[col].to_numpy(dtype=float)
+        edges = np.asarray(bins[col], dtype=float)
+        index = np.searchsorted(edges, values, side="right") - 1
+        index[values == edges[-1]] = n_bins[i] - 1
+        codes[:, i] = np.where((index >= 0) & (index < n_bins[i]), index, -1)
+
+    # Each pair (including a column with itself, for the 1D counts) gets a block of the flat counts.
+    x_index, y_index = np.triu_indices(len(columns))
+    sizes = n_bins[x_index] * n_bins[y_index]
+    offsets = np.cumsum(sizes) - sizes
+    counts = np.zeros(sizes.sum(), dtype=np.int64)
+    for start in range(0, len(df), chunksize):
+        x_codes = codes[start:start + chunksize, x_index]
+        y_codes = codes[start:start + chunksize, y_index]
+        valid = (x_codes >= 0) & (y_codes >= 0)
+        flat = offsets + x_codes * n_bins[y_index] + y_codes
+        counts += np.bincount(flat[valid], minlength=counts.size)
+
+    counts_1d = {}
+    counts_2d = {}
+    for x, y, offset, size in zip(x_index, y_index, offsets, sizes):
+        table = counts[offset:offset + size].reshape(n_bins[x], n_bins[y])
+        if x == y:
+            counts_1d[columns[x]] = np.diag(table)
+        else:
+            counts_2d[columns[x], columns[y]] = table
+    return counts_1d, counts_2d
+
+@profiling.profiled
+def kendall_matrix(df, columns=None, max_table_size=10**6):
+    """Return Kendall's tau-b and p-value matrices for all pairs of `columns`.
+
+    Missing values are handled pairwise. Each column is ranked once, and every pair is
+    then counted from the contingency table of their ranks (cumulative sums give the
+    concordant and discordant pairs), so cost is linear in participants for ordinal data.
+    Pairs whose table would exceed `max_table_size` cells fall back to scipy's merge-sort
+    implementation. P-values are asymptotic with tie correction, or exact (via scipy)
+    when there are no ties, same as `pingouin.corr(method="kendall")`.
+    """
+    import numpy as np
+    import pandas as pd
+    from scipy.stats import kendalltau
+
+    if columns is None:
+        columns = list(df.columns)
+    codes = {}
+    n_levels = {}
+    for col in columns:
+        codes[col], uniques = pd.factorize(df[col], sort=True)
+        n_levels[col] = len(uniques)
+    valid = np.column_stack([codes[col] >= 0 for col in columns])
+
+    r_mat = pd.DataFrame(np.eye(len(columns)), index=columns, columns=columns)
+    p_mat = pd.DataFrame(np.zeros((len(columns), len(columns))), index=columns, columns=columns)
+    for i, xcol in enumerate(columns):
+        for j in range(i):
+            ycol = columns[j]
+            mask = valid[:, i] & valid[:, j]
+            x = codes[xcol][mask]
+            y = codes[ycol][mask]
+            kx, ky = n_levels[xcol], n_levels[ycol]
+            if kx * ky > max_table_size:
+                r, p = kendalltau(x, y)
+            else:
+                table = np.bincount(x * ky + y, minlength=kx * ky).reshape(kx, ky)
+                r, p = _kendall_from_table(table, x, y)
+            r_mat.iloc[i, j] = r_mat.iloc[j, i] = r
+            p_mat.iloc[i, j] = p_mat.iloc[j, i] = p
+    return r_mat, p_mat
+
+def concordance_difference(tables):
+    """Return concordant minus discordant pairs of each of a stack of contingency tables (tables x levels x levels)."""
+    import numpy as np
+
+    tables = tables.astype(np.int64)
+    # Pairs strictly greater on both variables, and greater on x but lower on y.
+    higher = np.cumsum(np.cumsum(tables[:, ::-1, ::-1], axis=1), axis=2)[:, ::-1, ::-1]
+    higher = np.pad(higher, ((0, 0), (0, 1), (0, 1)))[:, 1:, 1:]
+    lower = np.cumsum(np.cumsum(tables[:, ::-1, :], axis=1), axis=2)[:, ::-1, :]
+    lower = np.pad(lower, ((0, 0), (0, 1), (1, 0)))[:, 1:, :-1]
+    return (tables * higher).sum(axis=(1, 2)) - (tables * lower).sum(axis=(1, 2))
+
+def _kendall_from_table(table, x, y):
+    """Return Kendall's tau-b and p-value from a contingency table of ranks.
+
+    The original ranks `x` and `y` are only used for an exact p-value when there are no ties.
+    """
+    import numpy as np
+    from scipy.stats import kendalltau, norm
+
+    table = table.astype(np.int64)
+    size = int(table.sum())
+    tot = size * (size - 1) // 2
+    con_minus_dis = int(concordance_difference(table[None])[0])
+
+    def tie_stats(counts):
+        counts = counts.astype(float)
+        return (
+            (counts * (counts - 1) / 2).sum(),
+            (counts * (counts - 1) * (counts - 2)).sum(),
+            (counts * (counts - 1) * (2 * counts + 5)).sum(),
+        )
+    xtie, x0, x1 = tie_stats(table.sum(axis=1))
+    ytie, y0, y1 = tie_stats(table.sum(axis=0))
+
+    if xtie == tot or ytie == tot:
+        return np.nan, np.nan
+    if xtie == 0 and ytie == 0:
+        return kendalltau(x, y)
+    tau = con_minus_dis / np.sqrt(tot - xtie) / np.sqrt(tot - ytie)
+    tau = min(1., max(-1., tau))
+    m = size * (size - 1.)
+    var = ((m * (2 * size + 5) - x1 - y1) / 18
+        + (2 * xtie * ytie) / m + x0 * y0 / (9 * m * (size - 2)))
+    pval = 2 * norm.sf(abs(con_minus_dis) / np.sqrt(var))
+    return tau, pval
 
 def vertical_sigbar(ax, y1, y2, x, p, width=0.1, linewidth=1, caplength=None):
     """significance bar vertical, with hooks to the left.
@@ -198,44 +965,127 @@ def vertical_sigbar(ax, y1, y2, x, p, width=0.1, linewidth=1, caplength=None):
             rotation=270, ha="center", va="center", transform=ax.get_yaxis_transform()
         )
 
-def load_matplotlib_settings():
-    plt.rcParams["savefig.dpi"] = 1200
-    plt.rcParams["interactive"] = True
-    plt.rcParams["figure.constrained_layout.use"] = True
-    plt.rcParams["font.family"] = "Times New Roman"
-    # plt.rcParams["font.sans-serif"] = "Arial"
-    plt.rcParams["mathtext.fontset"] = "custom"
-    plt.rcParams["mathtext.rm"] = "Times New Roman"
-    plt.rcParams["mathtext.cal"] = "Times New Roman"
-    plt.rcParams["mathtext.it"] = "Times New Roman:italic"
-    plt.rcParams["mathtext.bf"] = "Times New Roman:bold"
-    plt.rcParams["font.size"] = 8
-    plt.rcParams["axes.titlesize"] = 8
-    plt.rcParams["axes.labelsize"] = 8
-    plt.rcParams["axes.labelsize"] = 8
-    plt.rcParams["xtick.labelsize"] = 8
-    plt.rcParams["ytick.labelsize"] = 8
-    plt.rcParams["axes.linewidth"] = 0.8  # Edge linewidth
-    plt.rcParams["axes.axisbelow"] = True
-    plt.rcParams["axes.grid"] = True
-    plt.rcParams["axes.grid.axis"] = "y"
-    plt.rcParams["axes.grid.which"] = "major"
-    plt.rcParams["axes.labelpad"] = 4
-    plt.rcParams["xtick.top"] = True
-    plt.rcParams["ytick.right"] = True
-    plt.rcParams["xtick.direction"] = "in"
-    plt.rcParams["ytick.direction"] = "in"
-    plt.rcParams["grid.color"] = "gainsboro"
-    plt.rcParams["grid.linewidth"] = 1
-    plt.rcParams["grid.alpha"] = 1
-    plt.rcParams["legend.frameon"] = False
-    plt.rcParams["legend.edgecolor"] = "black"
-    plt.rcParams["legend.fontsize"] = 8
-    plt.rcParams["legend.title_fontsize"] = 8
-    plt.rcParams["legend.borderpad"] = 0.4
-    plt.rcParams["legend.labelspacing"] = 0.2  # the vertical space between the legend entries
-    plt.rcParams["legend.handlelength"] = 2  # the length of the legend lines
-    plt.rcParams["legend.handleheight"] = 0.7  # the height of the legend handle
-    plt.rcParams["legend.handletextpad"] = 0.2  # the space between the legend line and legend text
-    plt.rcParams["legend.borderaxespad"] = 0.5  # the border between the axes and legend edge
-    plt.rcParams["legend.columnspacing"] = 1  # the space between the legend line and legend text
+# Matplotlib settings of all figures (see `figure_style`).
+FIGURE_STYLE = {
+    "savefig.dpi": 1200,
+    "figure.constrained_layout.use": True,
+    "font.family": "Times New Roman",
+    # "font.sans-serif": "Arial",
+    "mathtext.fontset": "custom",
+    "mathtext.rm": "Times New Roman",
+    "mathtext.cal": "Times New Roman",
+    "mathtext.it": "Times New Roman:italic",
+    "mathtext.bf": "Times New Roman:bold",
+    "font.size": 8,
+    "axes.titlesize": 8,
+    "axes.labelsize": 8,
+    "xtick.labelsize": 8,
+    "ytick.labelsize": 8,
+    "axes.linewidth": 0.8,  # Edge linewidth
+    "axes.axisbelow": True,
+    "axes.grid": True,
+    "axes.grid.axis": "y",
+    "axes.grid.which": "major",
+    "axes.labelpad": 4,
+    "xtick.top": True,
+    "ytick.right": True,
+    "xtick.direction": "in",
+    "ytick.direction": "in",
+    "grid.color": "gainsboro",
+    "grid.linewidth": 1,
+    "grid.alpha": 1,
+    "legend.frameon": False,
+    "legend.edgecolor": "black",
+    "legend.fontsize": 8,
+    "legend.title_fontsize": 8,
+    "legend.borderpad": 0.4,
+    "legend.labelspacing": 0.2,  # the vertical space between the legend entries
+    "legend.handlelength": 2,  # the length of the legend lines
+    "legend.handleheight": 0.7,  # the height of the legend handle
+    "legend.handletextpad": 0.2,  # the space between the legend line and legend text
+    "legend.borderaxespad": 0.5,  # the border between the axes and legend edge
+    "legend.columnspacing": 1,  # the space between the legend line and legend text
+}
+
+# Matplotlib settings are global, so only one thread at a time can be inside `figure_style`.
+_style_lock = threading.RLock()
+
+
+@contextmanager
+def figure_style(style=FIGURE_STYLE):
+    """Apply matplotlib `style` settings (rcParams) within the block, restoring the previous ones after.
+
+    Figures and their artists pick up most settings when created and the rest when saved,
+    so create them with `new_figure` and draw them within the block, and save them with
+    `save_figure` (which applies the same style). Threads take turns at the block, and
+    for rendering in parallel `save_figure` sends the style along to its worker processes.
+
+        with utils.figure_style():
+            fig = utils.new_figure(figsize=(2, 2))
+            ax = fig.subplots()
+            ...
+        utils.save_figure(fig, export_path)
+    """
+    import matplotlib
+
+    with _style_lock, matplotlib.rc_context(style):
+        yield
+
+def new_figure(**kwargs):
+    """Return a figure on the Agg canvas, made without pyplot (`kwargs` go to `matplotlib.figure.Figure`).
+
+    Nothing global keeps track of the figure, so it's never shown and doesn't need closing.
+    """
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    fig = Figure(**kwargs)
+    FigureCanvasAgg(fig)
+    return fig
+
+def _render_figure(task):
+    """Unpickle and save one figure format, returning the render time in seconds."""
+    pickled_fig, export_path, dpi, style = task
+    start = time.perf_counter()
+    with figure_style(style):
+        fig = pickle.loads(pickled_fig)
+        fig.savefig(export_path, dpi=dpi)
+    return time.perf_counter() - start
+
+@profiling.profiled
+def save_figure(fig, export_path, formats=None, dpi=None, style=FIGURE_STYLE, n_jobs=None):
+    """Save `fig` to `export_path` in each of `formats` with `style` settings.
+
+    `formats` (file extensions), `dpi`, and `n_jobs` default to the "figure_formats",
+    "figure_dpi", and "n_jobs" configuration options, so a low-dpi draft can be set for
+    a whole run from config.json. With `n_jobs` > 1, formats are rendered in parallel processes.
+    Prints and returns the render time of each format.
+    """
+    config = load_config()
+    formats = config["figure_formats"] if formats is None else formats
+    dpi = config["figure_dpi"] if dpi is None else dpi
+    n_jobs = config.get("n_jobs", 1) if n_jobs is None else n_jobs
+    export_path = Path(export_path)
+    export_paths = [export_path.with_suffix(f".{fmt}") for fmt in formats]
+    if n_jobs == 1 or len(export_paths) == 1:
+        render_times = []
+        with figure_style(style):
+            for p in export_paths:
+                start = time.perf_counter()
+                fig.savefig(p, dpi=dpi)
+                render_times.append(time.perf_counter() - start)
+    else:
+        # Send each worker a pickled copy of the figure and the style settings.
+        pickled_fig = pickle.dumps(fig)
+        tasks = [(pickled_fig, p, dpi, style) for p in export_paths]
+        with ProcessPoolExecutor(max_workers=min(n_jobs, len(tasks))) as executor:
+            render_times = list(executor.map(_render_figure, tasks))
+    for p, seconds in zip(export_paths, render_times):
+        print(f"Saved {p.name} in {seconds:.2f} s")
+    return dict(zip(formats, render_times))
+
+
+# Profile the running script if switched on, except in worker processes.
+if profiling.enabled() and multiprocessing.parent_process() is None:
+    profiling.start(Path(sys.argv[0]).name or "python")
+    atexit.register(_stop_profiling)
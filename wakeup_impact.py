@@ -3,10 +3,13 @@
 from pathlib import Path
 
 import colorcet as cc
-import matplotlib.pyplot as plt
+from matplotlib.patches import Patch
+from matplotlib.ticker import MultipleLocator, PercentFormatter
 import pingouin as pg
 from statsmodels.graphics.mosaicplot import mosaic
 
+import profiling
+import resampling
 import utils
 
 
@@ -14,9 +17,6 @@ import utils
 # SETUP
 ################################################################################
 
-# Load custom plotting settings.
-utils.load_matplotlib_settings()
-
 # Choose filepaths.
 config = utils.load_config()
 root_dir = Path(config["root_directory"])
@@ -42,10 +42,22 @@ COLUMN_B = "Wakeup_impact"
 ################################################################################
 
 # Remove correction to get integers/counts in `observed` contingency table output.
-expected, observed, stats = pg.chi2_independence(df, COLUMN_A, COLUMN_B, correction=False)
+with profiling.stage("pg.chi2_independence", rows_in=len(df)):
+    expected, observed, stats = pg.chi2_independence(df, COLUMN_A, COLUMN_B, correction=False)
 # Reformat contingency table for exporting.
 observed = observed.stack().rename("count")
 
+# Add permutation p-value and bootstrapped effect size confidence interval to the pearson test.
+resampling_kwargs = dict(n_resamples=config["n_resamples"], seed=config["random_seed"], n_jobs=config["n_jobs"])
+x = df[COLUMN_A].to_numpy()
+y = df[COLUMN_B].to_numpy()
+_, pval_perm = resampling.permutation_test(x, y, resampling.chi2_statistic, **resampling_kwargs)
+cramer_ci = resampling.bootstrap_ci(x, y, resampling.cramers_v, **resampling_kwargs)
+is_pearson = stats["test"].eq("pearson")
+stats.loc[is_pearson, "pval_perm"] = pval_perm
+stats.loc[is_pearson, "cramer_CI[2.5%]"] = cramer_ci[0]
+stats.loc[is_pearson, "cramer_CI[97.5%]"] = cramer_ci[1]
+
 
 ################################################################################
 # PLOTTING
@@ -85,73 +97,74 @@ props = lambda key: {  # ("True", "True") strings(?) tuple in key_order
     "alpha": 1,
 }
 
-# Open figure.
-fig, ax = plt.subplots(figsize=FIGSIZE, gridspec_kw=GRIDSPEC_KW)
-
-# Draw boxes.
-_, rects = mosaic(
-    data=observed,
-    properties=props,
-    labelizer=lambda x: None,
-    # horizontal=True,
-    # axes_label=True,
-    gap=0.05,
-    ax=ax,
-)
-
-# Aesthetics.
-ax.set_xlabel("Dream task")
-ax.set_ylabel("Relative frequency")
-ax.yaxis.set(
-    major_locator=plt.MultipleLocator(0.5),
-    minor_locator=plt.MultipleLocator(0.1),
-    major_formatter=plt.matplotlib.ticker.PercentFormatter(xmax=1),
-)
-ax.spines["top"].set_visible(False)
-ax.spines["right"].set_visible(False)
-ax.spines["left"].set_position(("outward", 5))
-ax.spines["bottom"].set_position(("outward", 5))
-
-ax2 = ax.twiny()
-ax2.spines["top"].set_position(("outward", 5))
-ax2.set_xlabel("Relative frequency", labelpad=6)
-ax2.xaxis.set(major_locator=plt.MultipleLocator(0.5),
-    minor_locator=plt.MultipleLocator(0.1),
-    major_formatter=plt.matplotlib.ticker.PercentFormatter(xmax=1))
-
-ax.tick_params(which="both", direction="out")
-ax2.tick_params(which="both", direction="out")
-
-# Legend.
-handles = [
-    plt.matplotlib.patches.Patch(edgecolor="none", label=l, facecolor=c) for l, c in palette.items()
-]
-legend = ax.legend(
-    handles=handles[::-1],
-    title=LEGEND_TITLE,
-    loc="upper left",
-    bbox_to_anchor=(1, 1),
-    borderaxespad=0,
-    frameon=False,
-    labelspacing=0.1,
-    handletextpad=0.2,
-)
-# legend._legend_box.sep = 2 # brings title up farther on top of handles/labels
-legend._legend_box.align = "left"
-
-# Add significance text.
-sigchars = "*" * sum([pval < cutoff for cutoff in (0.05, 0.01, 0.001)])
-ptxt = r"p<0.001" if pval < .001 else fr"$p={pval:.3f}$"
-ptxt = ptxt.replace("0.", ".", 1)
-chi2txt = fr"$\chi^2={chi2val:.1f}$"
-stats_txt = chi2txt + "\n" + ptxt + sigchars
-ax.text(
-    SIG_XLOC, SIG_YLOC, stats_txt, transform=ax.transAxes, ha="left", va="top", linespacing=1
-)
+# Open figure, and draw with the figure style.
+with utils.figure_style():
+    fig = utils.new_figure(figsize=FIGSIZE)
+    ax = fig.subplots(gridspec_kw=GRIDSPEC_KW)
+
+    # Draw boxes.
+    _, rects = mosaic(
+        data=observed,
+        properties=props,
+        labelizer=lambda x: None,
+        # horizontal=True,
+        # axes_label=True,
+        gap=0.05,
+        ax=ax,
+    )
+
+    # Aesthetics.
+    ax.set_xlabel("Dream task")
+    ax.set_ylabel("Relative frequency")
+    ax.yaxis.set(
+        major_locator=MultipleLocator(0.5),
+        minor_locator=MultipleLocator(0.1),
+        major_formatter=PercentFormatter(xmax=1),
+    )
+    ax.spines["top"].set_visible(False)
+    ax.spines["right"].set_visible(False)
+    ax.spines["left"].set_position(("outward", 5))
+    ax.spines["bottom"].set_position(("outward", 5))
+
+    ax2 = ax.twiny()
+    ax2.spines["top"].set_position(("outward", 5))
+    ax2.set_xlabel("Relative frequency", labelpad=6)
+    ax2.xaxis.set(major_locator=MultipleLocator(0.5),
+        minor_locator=MultipleLocator(0.1),
+        major_formatter=PercentFormatter(xmax=1))
+
+    ax.tick_params(which="both", direction="out")
+    ax2.tick_params(which="both", direction="out")
+
+    # Legend.
+    handles = [
+        Patch(edgecolor="none", label=l, facecolor=c) for l, c in palette.items()
+    ]
+    legend = ax.legend(
+        handles=handles[::-1],
+        title=LEGEND_TITLE,
+        loc="upper left",
+        bbox_to_anchor=(1, 1),
+        borderaxespad=0,
+        frameon=False,
+        labelspacing=0.1,
+        handletextpad=0.2,
+    )
+    # legend._legend_box.sep = 2 # brings title up farther on top of handles/labels
+    legend._legend_box.align = "left"
+
+    # Add significance text.
+    sigchars = "*" * sum([pval < cutoff for cutoff in (0.05, 0.01, 0.001)])
+    ptxt = r"p<0.001" if pval < .001 else fr"$p={pval:.3f}$"
+    ptxt = ptxt.replace("0.", ".", 1)
+    chi2txt = fr"$\chi^2={chi2val:.1f}$"
+    stats_txt = chi2txt + "\n" + ptxt + sigchars
+    ax.text(
+        SIG_XLOC, SIG_YLOC, stats_txt, transform=ax.transAxes, ha="left", va="top", linespacing=1
+    )
+
 
 # Export.
 observed.to_csv(export_path_freq, index=True, na_rep="n/a", sep="\t")
 stats.to_csv(export_path_stat, index=False, na_rep="n/a", sep="\t")
-plt.savefig(export_path_plot)
-plt.savefig(export_path_plot.with_suffix(".pdf"))
-plt.savefig(export_path_plot.with_suffix(".svg"))
+utils.save_figure(fig, export_path_plot)
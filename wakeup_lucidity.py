@@ -3,10 +3,11 @@ Run correlation analysis asking if lucidity during the dream task influenced rep
 """
 from pathlib import Path
 
-import matplotlib.pyplot as plt
 import numpy as np
 import pingouin as pg
 
+import profiling
+import resampling
 import utils
 
 
@@ -20,9 +21,6 @@ lucidity_col = "Task_lucid"
 wakeup_label = "Time between task and awakening"
 lucidity_label = "Lucidity while performing the task"
 
-# Load custom plotting settings.
-utils.load_matplotlib_settings()
-
 # Choose filepaths.
 config = utils.load_config()
 root_dir = Path(config["root_directory"])
@@ -50,7 +48,15 @@ desc = df[[wakeup_col, lucidity_col]].describe().T.rename_axis("variable")
 # Run correlation.
 x = df[lucidity_col].to_numpy()
 y = df[wakeup_col].to_numpy()
-stat = pg.corr(x, y, method="kendall")
+with profiling.stage("pg.corr", rows_in=len(x)):
+    stat = pg.corr(x, y, method="kendall")
+
+# Add permutation p-value and bootstrapped confidence interval.
+resampling_kwargs = dict(n_resamples=config["n_resamples"], seed=config["random_seed"], n_jobs=config["n_jobs"])
+_, pval_perm = resampling.permutation_test(x, y, resampling.kendall_statistic, **resampling_kwargs)
+tau_ci = resampling.bootstrap_ci(x, y, resampling.kendall_statistic, **resampling_kwargs)
+stat["p-val_perm"] = pval_perm
+stat["CI95%_boot"] = [tau_ci.round(2)]
 
 
 ################################################################################
@@ -62,27 +68,27 @@ coef = np.polyfit(x, y, 1)
 poly1d_func = np.poly1d(coef)
 
 # Grab ticks and labels from the sidecar file.
-xticks, xticklabels = zip(*meta[wakeup_col]["Levels"].items())
-xticks = list(map(int, xticks))
-yticks, yticklabels = zip(*meta[lucidity_col]["Levels"].items())
-yticks = list(map(int, yticks))
+xticks, xticklabels = zip(*meta.levels(wakeup_col).items())
+yticks, yticklabels = zip(*meta.levels(lucidity_col).items())
 
-# Open figure.
-fig, ax = plt.subplots(figsize=(2.4, 2.4))
+# Open figure, and draw with the figure style.
+with utils.figure_style():
+    fig = utils.new_figure(figsize=(2.4, 2.4))
+    ax = fig.subplots()
 
-# Draw dots and regression line.
-ax.plot(x, y, "ko", ms=5, alpha=0.2)
-ax.plot(x, poly1d_func(x), "-k")
+    # Draw dots and regression line.
+    ax.plot(x, y, "ko", ms=5, alpha=0.2)
+    ax.plot(x, poly1d_func(x), "-k")
 
-# Aesthetics.
-ax.set_xticks(xticks)
-ax.set_yticks(yticks)
-ax.set_xlabel(lucidity_label)
-ax.set_ylabel(wakeup_label)
-ax.grid(True, axis="both")
-ax.set_aspect("equal")
-ax.margins(0.1)
-ax.tick_params(direction="out", axis="both", which="both", top=False, right=False)
+    # Aesthetics.
+    ax.set_xticks(xticks)
+    ax.set_yticks(yticks)
+    ax.set_xlabel(lucidity_label)
+    ax.set_ylabel(wakeup_label)
+    ax.grid(True, axis="both")
+    ax.set_aspect("equal")
+    ax.margins(0.1)
+    ax.tick_params(direction="out", axis="both", which="both", top=False, right=False)
 
 
 ################################################################################
@@ -91,6 +97,4 @@ ax.tick_params(direction="out", axis="both", which="both", top=False, right=Fals
 
 desc.to_csv(export_path_desc, na_rep="n/a", sep="\t")
 stat.to_csv(export_path_stat, index_label="method", na_rep="n/a", sep="\t")
-plt.savefig(export_path_plot)
-plt.savefig(export_path_plot.with_suffix(".pdf"))
-plt.savefig(export_path_plot.with_suffix(".svg"))
+utils.save_figure(fig, export_path_plot)
@@ -4,11 +4,13 @@ from math import ceil
 from pathlib import Path
 
 import colorcet as cc
-import matplotlib.pyplot as plt
+from matplotlib.patches import Patch
 import numpy as np
 import pandas as pd
 import pingouin as pg
 
+import profiling
+import resampling
 import utils
 
 
@@ -20,9 +22,6 @@ task_mapping = {"Clench": 1, "Visual": 0}
 task_col = "Condition"
 wakeup_col = "Wakeup"
 
-# Load custom plotting settings.
-utils.load_matplotlib_settings()
-
 # Choose filepaths.
 config = utils.load_config()
 root_dir = Path(config["root_directory"])
@@ -45,7 +44,18 @@ df[wakeup_col] = df[wakeup_col].astype(int)
 ################################################################################
 
 # Run regression.
-stat = pg.linear_regression(X=df[wakeup_col], y=df[task_col], add_intercept=True)
+with profiling.stage("pg.linear_regression", rows_in=len(df)):
+    stat = pg.linear_regression(X=df[wakeup_col], y=df[task_col], add_intercept=True)
+
+# Add permutation p-value and bootstrapped confidence interval of the slope.
+resampling_kwargs = dict(n_resamples=config["n_resamples"], seed=config["random_seed"], n_jobs=config["n_jobs"])
+x = df[wakeup_col].to_numpy(dtype=float)
+y = df[task_col].to_numpy(dtype=float)
+_, pval_perm = resampling.permutation_test(x, y, resampling.slope_statistic, **resampling_kwargs)
+slope_ci = resampling.bootstrap_ci(x, y, resampling.slope_statistic, **resampling_kwargs)
+stat.loc[1, "pval_perm"] = pval_perm
+stat.loc[1, "CI[2.5%]_boot"] = slope_ci[0]
+stat.loc[1, "CI[97.5%]_boot"] = slope_ci[1]
 
 # Get descriptive counts.
 inverted_mapping = {v: k for k, v in task_mapping.items()}
@@ -77,8 +87,8 @@ cmap = cc.cm.linear_protanopic_deuteranopic_kbw_5_95_c34_r
 # cmap = cc.cm.linear_tritanopic_kcw_5_95_c22
 
 # Make sure wakeup responses are categorical.
-cats, cat_labels = zip(*meta[wakeup_col]["Levels"].items())
-cats = list(map(int, cats))
+cats, cat_labels = zip(*meta.levels(wakeup_col).items())
+cats = list(cats)
 df[wakeup_col] = pd.Categorical(df[wakeup_col], cats, ordered=True)
 
 n_categories = len(cats)
@@ -94,84 +104,86 @@ pcts = (df
 # pcts.columns = pcts.columns.map(inverted_mapping)
 # pcts = pcts.cumsum().shift(fill_value=0).sub(left_adjust)
 
-# Open figure.
-fig, ax = plt.subplots(figsize=figsize)
-
-# Build ticks on the fly to ensure order is correct.
-yticks = []
-yticklabels = []
-
-# Loop over eack task.
-for i, (task, ser) in enumerate(pcts.groupby(task_col)):
-    ## NOTE, this is overcomplicated since there are no gaps in the bars. Should just use barh.
-    ser = ser.droplevel(task_col)
-    left_adjust = ser.loc[:midpoint-1].sum()
-    ser = ser[ser!=0]
-    xlocs = ser.cumsum().shift(fill_value=0).sub(left_adjust).to_numpy()
-    xwidths = ser.to_numpy()
-    x = [(x, w) for x, w in zip(xlocs, xwidths)]
-    c = [cmap((j-1) / (n_categories-1)) for j in ser.index]
-    y = (i - bar_height / 2, bar_height)
-    bars = ax.broken_barh(x, y, color=c, linewidth=linewidth, edgecolor=edgecolor)
-    # broken_barh doesn't return BarCollections for ax.bar_label so set manually
-    for k in x:
-        x_ = np.cumsum(k).mean()
-        s = f"{k[1]:.0f}%"
-        c_ = "white" if x_ > 0 else "black"
-        ax.text(x_, i, s, color=c_, ha="center", va="center")
-    # Save yticks on the fly.
-    yticks.append(i)
-    yticklabels.append(inverted_mapping[task])
-
-# Write stats results.
-beta, pval = stat.loc[1, ["coef", "pval"]]
-utils.vertical_sigbar(ax, y1=yticks[0], y2=yticks[1], x=1.04, p=pval, width=0.02, caplength=None, linewidth=1)
-# sigchars = "*" * sum([pval < cutoff for cutoff in (0.05, 0.01, 0.001)])
-# ptxt = r"p<0.001" if pval < .001 else fr"$p={pval:.3f}$"
-# ptxt = ptxt.replace("0.", ".", 1)
-# btxt = fr"$\beta={beta:.2f}$"
-# stats_txt = btxt + "\n" + ptxt + sigchars
-# ax.text(1, 1, stats_txt, transform=ax.transAxes, ha="right", va="top", linespacing=1)
-
-# Aesthetics.
-ax.axvline(0, color="black", linewidth=linewidth, zorder=0)
-ax.margins(x=0, y=0.1)
-xticks_minor = range(-100, 101, 10)
-xticks = range(-100, 101, 50)
-xticklabels = [f"{abs(x)}%" for x in xticks]
-ax.set_xticks(xticks)
-ax.set_xticks(xticks_minor, minor=True)
-ax.set_xticklabels(xticklabels)
-# ax.set_ylim(-1, n_tasks)
-# ax.set_xlabel("Relative percentage")
-ax.set_ylabel("Dream task")
-ax.set_yticks(yticks)
-ytick_longlabels = {
-    "Clench": "Clench fist",
-    "Visual": "Close eyes\nand wakeup",
-}
-yticklabels = [ytick_longlabels[k] for k in yticklabels]
-ax.set_yticklabels(yticklabels)
-ax.tick_params(which="both", axis="both", direction="out", top=False, right=False)
-ax.tick_params(which="both", left=False, bottom=False, labelbottom=False)
-ax.spines[["top", "right", "bottom", "left"]].set_visible(False)
-
-# Legend.
-handles = [
-    plt.matplotlib.patches.Patch(
-        facecolor=cmap((i-1) / (n_categories-1)), label=l, edgecolor=edgecolor, linewidth=linewidth
-    ) for i, l in zip(cats, probe_labels)
-]
-legend = ax.legend(handles=handles,
-    title=probe,
-    loc="lower center", bbox_to_anchor=(0.5, 1),
-    borderaxespad=0.2, frameon=False,
-    labelspacing=0.2,  # rowspacing, vertical space between the legend entries
-    handletextpad=0.2,  # space between legend marker and label
-    # fontsize=8,
-    ncol=n_categories,
-)
-legend._legend_box.sep = 5
+# Open figure, and draw with the figure style.
+with utils.figure_style():
+    fig = utils.new_figure(figsize=figsize)
+    ax = fig.subplots()
+
+    # Build ticks on the fly to ensure order is correct.
+    yticks = []
+    yticklabels = []
+
+    # Loop over eack task.
+    for i, (task, ser) in enumerate(pcts.groupby(task_col)):
+        ## NOTE, this is overcomplicated since there are no gaps in the bars. Should just use barh.
+        ser = ser.droplevel(task_col)
+        left_adjust = ser.loc[:midpoint-1].sum()
+        ser = ser[ser!=0]
+        xlocs = ser.cumsum().shift(fill_value=0).sub(left_adjust).to_numpy()
+        xwidths = ser.to_numpy()
+        x = [(x, w) for x, w in zip(xlocs, xwidths)]
+        c = [cmap((j-1) / (n_categories-1)) for j in ser.index]
+        y = (i - bar_height / 2, bar_height)
+        bars = ax.broken_barh(x, y, color=c, linewidth=linewidth, edgecolor=edgecolor)
+        # broken_barh doesn't return BarCollections for ax.bar_label so set manually
+        for k in x:
+            x_ = np.cumsum(k).mean()
+            s = f"{k[1]:.0f}%"
+            c_ = "white" if x_ > 0 else "black"
+            ax.text(x_, i, s, color=c_, ha="center", va="center")
+        # Save yticks on the fly.
+        yticks.append(i)
+        yticklabels.append(inverted_mapping[task])
+
+    # Write stats results.
+    beta, pval = stat.loc[1, ["coef", "pval"]]
+    utils.vertical_sigbar(ax, y1=yticks[0], y2=yticks[1], x=1.04, p=pval, width=0.02, caplength=None, linewidth=1)
+    # sigchars = "*" * sum([pval < cutoff for cutoff in (0.05, 0.01, 0.001)])
+    # ptxt = r"p<0.001" if pval < .001 else fr"$p={pval:.3f}$"
+    # ptxt = ptxt.replace("0.", ".", 1)
+    # btxt = fr"$\beta={beta:.2f}$"
+    # stats_txt = btxt + "\n" + ptxt + sigchars
+    # ax.text(1, 1, stats_txt, transform=ax.transAxes, ha="right", va="top", linespacing=1)
+
+    # Aesthetics.
+    ax.axvline(0, color="black", linewidth=linewidth, zorder=0)
+    ax.margins(x=0, y=0.1)
+    xticks_minor = range(-100, 101, 10)
+    xticks = range(-100, 101, 50)
+    xticklabels = [f"{abs(x)}%" for x in xticks]
+    ax.set_xticks(xticks)
+    ax.set_xticks(xticks_minor, minor=True)
+    ax.set_xticklabels(xticklabels)
+    # ax.set_ylim(-1, n_tasks)
+    # ax.set_xlabel("Relative percentage")
+    ax.set_ylabel("Dream task")
+    ax.set_yticks(yticks)
+    ytick_longlabels = {
+        "Clench": "Clench fist",
+        "Visual": "Close eyes\nand wakeup",
+    }
+    yticklabels = [ytick_longlabels[k] for k in yticklabels]
+    ax.set_yticklabels(yticklabels)
+    ax.tick_params(which="both", axis="both", direction="out", top=False, right=False)
+    ax.tick_params(which="both", left=False, bottom=False, labelbottom=False)
+    ax.spines[["top", "right", "bottom", "left"]].set_visible(False)
+
+    # Legend.
+    handles = [
+        Patch(
+            facecolor=cmap((i-1) / (n_categories-1)), label=l, edgecolor=edgecolor, linewidth=linewidth
+        ) for i, l in zip(cats, probe_labels)
+    ]
+    legend = ax.legend(handles=handles,
+        title=probe,
+        loc="lower center", bbox_to_anchor=(0.5, 1),
+        borderaxespad=0.2, frameon=False,
+        labelspacing=0.2,  # rowspacing, vertical space between the legend entries
+        handletextpad=0.2,  # space between legend marker and label
+        # fontsize=8,
+        ncol=n_categories,
+    )
+    legend._legend_box.sep = 5
 
 
 ################################################################################
@@ -180,6 +192,4 @@ legend._legend_box.sep = 5
 
 freq.to_csv(export_path_freq, index=False, na_rep="n/a", sep="\t")
 stat.to_csv(export_path_stat, index=False, na_rep="n/a", sep="\t")
-plt.savefig(export_path_plot)
-plt.savefig(export_path_plot.with_suffix(".pdf"))
-plt.savefig(export_path_plot.with_suffix(".svg"))
+utils.save_figure(fig, export_path_plot)